@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Generation benchmark for Focal Psychology
+Runs generate_images.py / generate_qwen.py against fake ComfyUI servers and
+reports throughput, prompt latency, request counts and peak memory
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_comfyui import FakeComfyUI
+from run_metrics import percentile
+
+ROOT = Path(__file__).parent
+SCRIPTS = ("generate_images.py", "generate_qwen.py")
+
+
+def run_script(script: str, args, servers: list) -> dict:
+    """Run one generator against `servers` into a scratch directory; returns its measurements"""
+    with tempfile.TemporaryDirectory(prefix="focal-bench-") as scratch:
+        output_dir = Path(scratch) / "images"
+        report_path = Path(scratch) / "report.json"
+        command = [sys.executable, str(ROOT / script), "--output-dir", str(output_dir), "--force",
+                   "--report", str(report_path),
+                   "--window", str(args.window), "--timeout", str(args.timeout),
+                   "--variants", str(args.variants)]
+        for server in servers:
+            command += ["--backend", server.url]
+        if args.poll:
+            command.append("--poll")
+
+        log = Path(scratch) / "log.txt"
+        started = time.time()
+        with open(log, "wb") as out:
+            process = subprocess.Popen(command, stdout=out, stderr=subprocess.STDOUT, cwd=scratch)
+            # wait4 gives this child's own rusage, not the maximum over every child so far
+            _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.time() - started
+        images = sorted(path.name for path in output_dir.glob("*.jpg"))
+        output = log.read_text(encoding="utf-8", errors="replace")
+        report = json.loads(report_path.read_text(encoding="utf-8")) if report_path.exists() else {}
+
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0:
+        print(output[-2000:])
+        print(f"WARNING: {script} exited with {exit_code}")
+
+    requests, latencies, failed, model_loads = {}, [], 0, 0
+    for server in servers:
+        stats = server.stats()
+        model_loads += stats["model_loads"]
+        for endpoint, count in stats["requests"].items():
+            requests[endpoint] = requests.get(endpoint, 0) + count
+        for timing in stats["prompts"].values():
+            failed += bool(timing.get("failed"))
+            if "last_view" in timing:
+                latencies.append(timing["last_view"] - timing["queued"])
+    return {
+        "script": script,
+        "exit_code": exit_code,
+        "seconds": round(seconds, 2),
+        "images": len(images),
+        "images_per_minute": round(len(images) * 60 / seconds, 1) if seconds else 0.0,
+        "latency_p50": round(percentile(latencies, 0.50), 2),
+        "latency_p95": round(percentile(latencies, 0.95), 2),
+        "prompts": requests.get("/prompt", 0),
+        "failed_prompts": failed,
+        "retries": output.count("RETRY:"),
+        "errors": output.count("  ERROR:"),
+        "model_loads": model_loads,
+        "requests": dict(sorted(requests.items())),
+        # The generator's own view: where each job's time went
+        "stages": {stage: {"p50": values["p50"], "p95": values["p95"]}
+                   for stage, values in report.get("stages", {}).items() if values["count"]},
+        "download_bytes": report.get("bytes", 0),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['script']}:")
+    print(f"  Images: {result['images']} in {result['seconds']}s "
+          f"({result['images_per_minute']} images/min)")
+    print(f"  Prompt latency (queued -> downloaded): p50 {result['latency_p50']}s, "
+          f"p95 {result['latency_p95']}s")
+    print(f"  Prompts: {result['prompts']}, failed: {result['failed_prompts']}, "
+          f"retries: {result['retries']}, errors: {result['errors']}, model loads: {result['model_loads']}")
+    print("  Requests: " + ", ".join(f"{endpoint} {count}" for endpoint, count in result["requests"].items()))
+    print("  Stages (p50/p95): " + ", ".join(f"{stage} {values['p50']}/{values['p95']}s"
+                                            for stage, values in result["stages"].items()))
+    print(f"  Peak RSS: {result['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image generators against fake ComfyUI servers")
+    parser.add_argument("--script", action="append", choices=SCRIPTS,
+                        help="generator to run, repeat for both (default: both)")
+    parser.add_argument("--backends", type=int, default=1, help="fake ComfyUI servers to start")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds of fake execution per image")
+    parser.add_argument("--jitter", type=float, default=0.05, help="up to this many random extra seconds")
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="extra seconds when a prompt needs other models than the previous one")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of prompts that fail (0-1)")
+    parser.add_argument("--image-kb", type=int, default=200, help="size of every returned image in KB")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the fake servers")
+    parser.add_argument("--window", type=int, default=4, help="passed on to the generators")
+    parser.add_argument("--timeout", type=int, default=30, help="passed on to the generators")
+    parser.add_argument("--variants", type=int, default=1, help="passed on to the generators")
+    parser.add_argument("--poll", action="store_true", help="make the generators poll /history")
+    parser.add_argument("--json", type=Path, metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--min-rate", type=float, default=None, metavar="IMAGES_PER_MINUTE",
+                        help="exit with status 1 if any generator is slower than this")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Generation Benchmark")
+    print("=" * 60)
+    print(f"Fake ComfyUI: {args.backends} backend(s), {args.latency}s/image (+{args.jitter}s jitter), "
+          f"load {args.load_latency}s, failure rate {args.failure_rate}, {args.image_kb} KB images")
+    print("=" * 60)
+
+    results = []
+    for script in args.script or SCRIPTS:
+        # Fresh servers per run so counts and model loads belong to one generator
+        servers = [FakeComfyUI(latency=args.latency, jitter=args.jitter, load_latency=args.load_latency,
+                               failure_rate=args.failure_rate, image_size=args.image_kb * 1024,
+                               seed=args.seed + i).start()
+                   for i in range(args.backends)]
+        try:
+            result = run_script(script, args, servers)
+        finally:
+            for server in servers:
+                server.stop()
+        results.append(result)
+        print_result(result)
+
+    if args.json:
+        args.json.write_text(json.dumps({"settings": {k: v for k, v in vars(args).items() if k != "json"},
+                                         "results": results}, indent=2, default=str) + "\n",
+                             encoding="utf-8")
+        print(f"Results: {args.json}")
+
+    slow = [r["script"] for r in results
+            if r["exit_code"] != 0 or (args.min_rate is not None and r["images_per_minute"] < args.min_rate)]
+    if slow:
+        print(f"FAILED: {', '.join(slow)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Static output builder for Focal Psychology
+Last build step: lists every file the site serves with its content hash in
+precache.json for the service worker, registers the worker on every page and
+writes Brotli and gzip copies of the text files next to them
+"""
+
+import argparse
+import gzip
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from string import Template
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from build_search import compact_json
+from site_build import (ROOT, file_hash, load_json, page_paths, sha256_bytes, site_relative, write_bytes,
+                        write_if_changed, write_json)
+
+TEMPLATES_DIR = ROOT / "templates"
+WORKER_TEMPLATE = TEMPLATES_DIR / "sw.js"
+WORKER_PATH = ROOT / "sw.js"
+MANIFEST_PATH = ROOT / "precache.json"
+STATE_PATH = ROOT / "assets.deps.json"
+# Bump when the manifest format changes
+MANIFEST_VERSION = 1
+HASH_LENGTH = 10
+
+# Files the page scripts fetch themselves, so no page links them
+DATA_FILES = ("search/*.json", "techniques/*.json")
+# Extra files served by the site that are worth compressing
+STATIC_FILES = ("robots.txt", "sitemap.xml")
+SHELL_SUFFIXES = {".css", ".js", ".woff2"}
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".xml", ".txt"}
+# Below this size the saving does not pay for the Content-Encoding header
+MIN_COMPRESS_BYTES = 512
+# Compressed copies live next to their files in these directories
+COMPRESSED_DIRS = ("", "chapters", "css", "fonts", "search", "techniques")
+
+URL_ATTRIBUTE = re.compile(r'\b(?:src|href)="([^"]+)"')
+SRCSET = re.compile(r'\bsrcset="([^"]+)"')
+CSS_URL = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+REGISTRATION = re.compile(r'[ \t]*<script id="sw-register">.*?</script>[ \t]*\n?', re.S)
+
+
+def registration_markup(prefix: str) -> str:
+    return (f'    <script id="sw-register">if ("serviceWorker" in navigator) '
+            f'navigator.serviceWorker.register("{prefix}sw.js");</script>\n')
+
+
+def with_registration(page_html: str, prefix: str) -> str:
+    """Register the service worker at the end of <body>; safe to run repeatedly"""
+    page_html = REGISTRATION.sub("", page_html)
+    return page_html.replace("</body>", registration_markup(prefix) + "</body>", 1)
+
+
+def linked_files(page: Path, page_html: str) -> set:
+    """Site files a page links to: scripts, styles, fonts and every image candidate"""
+    urls = URL_ATTRIBUTE.findall(page_html) + CSS_URL.findall(page_html)
+    for srcset in SRCSET.findall(page_html):
+        urls.extend(candidate.split()[0] for candidate in srcset.split(",") if candidate.strip())
+    for url in urls:
+        if url.endswith(".css") and "//" not in url and (page.parent / url).is_file():
+            urls.extend(CSS_URL.findall((page.parent / url).read_text(encoding="utf-8")))
+    files = set()
+    for url in urls:
+        if re.match(r"^(?:[a-z]+:|//|#)", url):
+            continue
+        path = (page.parent / url.split("#")[0].split("?")[0]).resolve()
+        if path.is_file() and ROOT.resolve() in path.parents:
+            files.add(path)
+    return files
+
+
+def hash_file(path: Path) -> str:
+    return file_hash(path)[:HASH_LENGTH]
+
+
+def compress(path: Path) -> tuple:
+    """Write path.gz and path.br when they are smaller than the file; runs in a worker process"""
+    data = path.read_bytes()
+    sizes = []
+    encoders = [("gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append(("br", lambda d: brotli.compress(d, quality=11)))
+    for extension, encode in encoders:
+        target = path.with_name(f"{path.name}.{extension}")
+        compressed = encode(data)
+        if len(compressed) < len(data):
+            write_bytes(target, compressed)
+            sizes.append(len(compressed))
+        elif target.exists():
+            target.unlink()
+    return len(data), sizes
+
+
+def remove_orphans() -> int:
+    """Delete compressed copies whose file is gone"""
+    removed = 0
+    for directory in COMPRESSED_DIRS:
+        for copy in (ROOT / directory).glob("*.[gb][zr]"):
+            if copy.suffix in (".gz", ".br") and not copy.with_suffix("").exists():
+                copy.unlink()
+                removed += 1
+    return removed
+
+
+def build(workers: int = None, rewrite: bool = True) -> None:
+    pages = page_paths()
+    linked = set()
+    for page in pages:
+        prefix = "../" * len(page.parent.relative_to(ROOT).parts)
+        page_html = page.read_text(encoding="utf-8")
+        if rewrite:
+            page_html = with_registration(page_html, prefix)
+            write_if_changed(page, page_html)
+        linked |= linked_files(page, page_html)
+    data = {path.resolve() for pattern in DATA_FILES for path in ROOT.glob(pattern)}
+    served = sorted({page.resolve() for page in pages} | linked | data)
+
+    files = {site_relative(path): hash_file(path) for path in served}
+    # The shell: the start page with its styles, scripts and fonts, and the indexes its scripts load
+    shell = {site_relative(path) for path in linked_files(pages[0], pages[0].read_text(encoding="utf-8"))
+             if path.suffix in SHELL_SUFFIXES}
+    shell |= {site_relative(pages[0]), "search/meta.json", "techniques/catalogue.json"}
+    precache = sorted(path for path in shell if path in files)
+
+    build_id = sha256_bytes(repr(sorted(files.items())).encode("utf-8"))[:HASH_LENGTH]
+    write_if_changed(MANIFEST_PATH, compact_json({"version": MANIFEST_VERSION, "build": build_id,
+                                                  "files": files, "precache": precache}))
+    template = Template(WORKER_TEMPLATE.read_text(encoding="utf-8"))
+    write_if_changed(WORKER_PATH, template.substitute(build=build_id))
+    total = sum((ROOT / path).stat().st_size for path in files)
+    shell_bytes = sum((ROOT / path).stat().st_size for path in precache)
+    print(f"Manifest: {len(files)} files ({total // 1024} KB), build {build_id}, "
+          f"shell {len(precache)} files ({shell_bytes // 1024} KB)")
+
+    # Recompress only files whose content changed since the last run
+    if brotli is None:
+        print("WARNING: no brotli module, writing gzip copies only (pip install brotli)")
+    state = load_json(STATE_PATH, {})
+    candidates = served + [MANIFEST_PATH, WORKER_PATH] + [ROOT / name for name in STATIC_FILES]
+    candidates = [path for path in candidates
+                  if path.exists() and path.suffix in COMPRESSIBLE and path.stat().st_size >= MIN_COMPRESS_BYTES]
+    hashes = {site_relative(path): file_hash(path) for path in candidates}
+    encodings = "gz,br" if brotli is not None else "gz"
+    stale = [path for path in candidates
+             if state.get(site_relative(path)) != f"{hashes[site_relative(path)]}:{encodings}"]
+    before = after = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, (size, sizes) in zip(stale, pool.map(compress, stale, chunksize=8)):
+            before += size
+            after += min(sizes, default=size)
+            state[site_relative(path)] = f"{hashes[site_relative(path)]}:{encodings}"
+    state = {path: value for path, value in state.items() if path in hashes}
+    write_json(STATE_PATH, state)
+    removed = remove_orphans()
+    print(f"Compressed: {len(stale)} of {len(candidates)} files"
+          + (f", {before // 1024} KB -> {after // 1024} KB" if stale else "")
+          + (f", removed {removed} stale copies" if removed else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precache manifest and compressed copies of Focal Psychology")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-html", action="store_true", help="leave the pages alone (no worker registration)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Static Output Builder")
+    print("=" * 60)
+    build(workers=args.jobs, rewrite=not args.no_html)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Shared stylesheet builder for Focal Psychology
+Moves the CSS rules the pages have in common into one minified, content-hashed
+file in css/, inlines only the above-the-fold subset and keeps page overrides
+"""
+
+import argparse
+import re
+from pathlib import Path
+
+from site_build import ROOT, page_paths, sha256_bytes, site_relative, write_if_changed, write_text
+
+CSS_DIR = ROOT / "css"
+SHARED_NAME = "site"
+# A rule goes into a shared file when at least this share of its pages has it verbatim
+SHARED_THRESHOLD = 0.5
+# Smallest set of pages worth a shared file; pages left over keep their CSS inline
+MIN_SHARED_PAGES = 3
+# Page designs drift apart over time; each round gives one family of pages its own file
+MAX_SHARED_FILES = 4
+# Tags, classes and ids that exist on every page before any markup is parsed
+ALWAYS_PRESENT = {"html", "body"}
+
+# The @font-face block of build_fonts.py stays where it is
+STYLE_BLOCK = re.compile(r'[ \t]*<style(?! id="font-faces")[^>]*>(.*?)</style>[ \t]*\n?', re.S)
+SHARED_LINK = re.compile(r'[ \t]*<link rel="preload" id="site-css" href="(?P<href>[^"]+)"[^>]*>[ \t]*\n?'
+                         r'(?:[ \t]*<noscript>.*?</noscript>[ \t]*\n?)?', re.S)
+HASHED_NAME = re.compile(rf"^{SHARED_NAME}\.[0-9a-f]+\.css$")
+COMMENT = re.compile(r"/\*.*?\*/", re.S)
+QUOTED = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+PSEUDO = re.compile(r"::?[\w-]+(?:\([^)]*\))?|\[[^\]]*\]")
+SIMPLE_SELECTOR = re.compile(r"[.#]?[\w-]+")
+TAG = re.compile(r"<([a-zA-Z][\w-]*)")
+CLASS_ATTRIBUTE = re.compile(r'\bclass="([^"]*)"')
+ID_ATTRIBUTE = re.compile(r'\bid="([^"]*)"')
+BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S)
+# Above the fold: everything before <main>, or the navigation and first <section>
+FOLD_END = re.compile(r"<main\b|</section>")
+
+
+def collapse(text: str, tight: str) -> str:
+    """Collapse whitespace outside strings and drop it around the `tight` characters"""
+    parts = QUOTED.split(text)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i])
+        parts[i] = re.sub(rf"\s*([{re.escape(tight)}])\s*", r"\1", part)
+    return "".join(parts).strip()
+
+
+def split_top_level(text: str, separator: str) -> list:
+    """Split on `separator` outside strings, parentheses and url() data"""
+    pieces, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote and text[i - 1] != "\\":
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            pieces.append(text[start:i])
+            start = i + 1
+    pieces.append(text[start:])
+    return [p for p in pieces if p.strip()]
+
+
+def parse_css(text: str) -> list:
+    """
+    Top-level rules of a stylesheet as (prelude, body) pairs.
+
+    body is a tuple of minified declarations for style rules and @font-face,
+    a list of nested rules for @media, @supports and @keyframes, and None for
+    statements such as @import.
+    """
+    text = COMMENT.sub("", text)
+    rules, i = [], 0
+    while i < len(text):
+        brace = text.find("{", i)
+        semicolon = text.find(";", i)
+        if brace < 0:
+            break
+        if 0 <= semicolon < brace and text[i:semicolon].strip().startswith("@"):
+            rules.append((collapse(text[i:semicolon], ","), None))
+            i = semicolon + 1
+            continue
+        depth, end = 1, brace + 1
+        while depth and end < len(text):
+            depth += {"{": 1, "}": -1}.get(text[end], 0)
+            end += 1
+        prelude = text[i:brace].strip()
+        inner = text[brace + 1:end - 1]
+        if prelude.startswith("@") and not prelude.startswith("@font-face"):
+            rules.append((collapse(prelude, ",:"), parse_css(inner)))
+        else:
+            declarations = tuple(collapse(d, ":,") for d in split_top_level(inner, ";"))
+            rules.append((collapse(prelude, ",>+~"), declarations))
+        i = end
+    return rules
+
+
+def serialize(rules: list) -> str:
+    out = []
+    for prelude, body in rules:
+        if body is None:
+            out.append(f"{prelude};")
+        elif isinstance(body, list):
+            out.append(f"{prelude}{{{serialize(body)}}}")
+        else:
+            out.append(f"{prelude}{{{';'.join(body)}}}")
+    return "".join(out)
+
+
+def serialize_one(rule) -> str:
+    return serialize([rule])
+
+
+def selectors(rule) -> set:
+    """Selectors a rule styles, used to tell whether two rules can override each other"""
+    prelude, body = rule
+    if isinstance(body, list) and not prelude.startswith("@keyframes"):
+        return set().union(*(selectors(r) for r in body)) if body else set()
+    return set(split_top_level(prelude, ","))
+
+
+def can_match(rule, names: set) -> bool:
+    """Whether some selector of the rule only uses tags, classes and ids in `names`"""
+    prelude, body = rule
+    if prelude.startswith("@keyframes"):
+        return False
+    if isinstance(body, list):
+        return any(can_match(r, names) for r in body)
+    if prelude.startswith("@"):
+        return True
+    return any(all(token in names for token in SIMPLE_SELECTOR.findall(PSEUDO.sub("", s)))
+               for s in split_top_level(prelude, ","))
+
+
+def filter_rules(rules: list, names: set) -> list:
+    """The part of `rules` that can style markup made of `names`"""
+    kept = []
+    for prelude, body in rules:
+        if isinstance(body, list) and not prelude.startswith("@keyframes"):
+            inner = filter_rules(body, names)
+            if inner:
+                kept.append((prelude, inner))
+        elif can_match((prelude, body), names):
+            kept.append((prelude, body))
+    return kept
+
+
+def markup_names(html: str) -> set:
+    """Tags, .classes and #ids used in a piece of markup"""
+    names = set(ALWAYS_PRESENT)
+    names.update(tag.lower() for tag in TAG.findall(html))
+    for classes in CLASS_ATTRIBUTE.findall(html):
+        names.update(f".{c}" for c in classes.split())
+    names.update(f"#{i}" for i in ID_ATTRIBUTE.findall(html))
+    return names
+
+
+def above_the_fold(html: str) -> str:
+    match = BODY.search(html)
+    body = match.group(1) if match else html
+    end = FOLD_END.search(body)
+    return body[:end.end()] if end else body
+
+
+def page_rules(html: str, page: Path) -> list:
+    """
+    Every rule that styles the page, in cascade order.
+
+    For a page this tool already rewrote that is the shared file it links
+    followed by its own overrides; the inlined critical subset repeats the
+    shared file and is ignored.
+    """
+    link = SHARED_LINK.search(html)
+    rules = []
+    if link:
+        shared = (page.parent / link.group("href")).resolve()
+        rules.extend(parse_css(shared.read_text(encoding="utf-8")))
+    for match in STYLE_BLOCK.finditer(html):
+        if link and 'id="critical-css"' in match.group(0):
+            continue
+        rules.extend(parse_css(match.group(1)))
+    return rules
+
+
+def shared_rules(pages: dict) -> list:
+    """Rules that enough pages have verbatim, in the order the pages use them"""
+    counts = {}
+    for rules in pages.values():
+        for rule in dict.fromkeys(map(serialize_one, rules)):
+            counts[rule] = counts.get(rule, 0) + 1
+    threshold = max(SHARED_THRESHOLD * len(pages), MIN_SHARED_PAGES)
+    common = {rule for rule, count in counts.items() if count >= threshold}
+
+    # The page holding most common rules decides the order; the others append theirs
+    ordered = {}
+    for rules in sorted(pages.values(), key=lambda r: -len(common & set(map(serialize_one, r)))):
+        for rule in rules:
+            if serialize_one(rule) in common:
+                ordered.setdefault(serialize_one(rule), rule)
+    return list(ordered.values())
+
+
+def split_page(rules: list, shared: list, names: set):
+    """
+    Split a page's rules into what a shared file covers and what it keeps inline.
+
+    The shared file is linked before the page's own rules, so a page rule that
+    originally came before a shared rule for the same selector would now win.
+    Such shared rules are repeated inline after it, as are shared rules the
+    page has in a different order than the file. Returns None if the shared
+    file would add a rule the page lacks and that could match its markup.
+    """
+    position = {serialize_one(rule): i for i, rule in enumerate(shared)}
+    own = set(map(serialize_one, rules))
+    for rule in shared:
+        if serialize_one(rule) not in own and can_match(rule, names):
+            return None
+
+    inline, seen = [], []
+    for rule in rules:
+        text = serialize_one(rule)
+        if text in position:
+            overridden = any(
+                selectors(rule) & selectors(earlier)
+                and (earlier_inline or position[serialize_one(earlier)] > position[text])
+                for earlier, earlier_inline in seen)
+            if not overridden:
+                seen.append((rule, False))
+                continue
+        inline.append(rule)
+        seen.append((rule, True))
+    return inline
+
+
+def plan_stylesheets(pages: dict, names: dict):
+    """
+    Group pages around shared files.
+
+    Each round computes the common rules of the pages still unassigned and
+    gives them to every page that can take the file without changing its
+    look; the rest go on to the next round. Returns (files, plan) where files
+    lists the shared rules of each file and plan maps page -> (file index,
+    inline rules), or None for a page that keeps all of its CSS inline.
+    """
+    files, plan = [], {}
+    remaining = dict(pages)
+    while remaining and len(files) < MAX_SHARED_FILES:
+        shared = shared_rules(remaining)
+        if not shared:
+            break
+        split = {page: split_page(rules, shared, names[page]) for page, rules in remaining.items()}
+        taken = [page for page, inline in split.items() if inline is not None]
+        if len(taken) < MIN_SHARED_PAGES:
+            break
+        for page in taken:
+            plan[page] = (len(files), split[page])
+            del remaining[page]
+        files.append(shared)
+    plan.update((page, None) for page in remaining)
+    return files, plan
+
+
+def stylesheet_markup(href: str, critical: str, inline: str) -> str:
+    """
+    Head markup: the critical subset inline, the shared file loaded without
+    blocking render, then the page's own rules so they still come last.
+    """
+    lines = []
+    if critical:
+        lines.append(f'<style id="critical-css">{critical}</style>')
+    lines.append(f'<link rel="preload" id="site-css" href="{href}" as="style" '
+                 f'onload="this.onload=null;this.rel=\'stylesheet\'">')
+    lines.append(f'<noscript><link rel="stylesheet" href="{href}"></noscript>')
+    if inline:
+        lines.append(f'<style id="page-css">{inline}</style>')
+    return "".join(f"    {line}\n" for line in lines)
+
+
+def rewrite_page(html: str, markup: str) -> str:
+    """Replace every stylesheet of the page with `markup` at the end of <head>"""
+    html = SHARED_LINK.sub("", html)
+    html = STYLE_BLOCK.sub("", html)
+    return html.replace("</head>", markup + "</head>", 1)
+
+
+def build(dry_run: bool = False) -> None:
+    sources = {page: page.read_text(encoding="utf-8") for page in page_paths()}
+    pages = {page: page_rules(html, page) for page, html in sources.items()}
+    names = {page: markup_names(html) for page, html in sources.items()}
+    files, plan = plan_stylesheets(pages, names)
+
+    css_paths = []
+    for index, shared in enumerate(files):
+        css = serialize(shared)
+        css_paths.append(CSS_DIR / f"{SHARED_NAME}.{sha256_bytes(css.encode('utf-8'))[:10]}.css")
+        users = sum(1 for assigned in plan.values() if assigned and assigned[0] == index)
+        print(f"Shared file {css_paths[-1].name}: {len(shared)} rules, "
+              f"{len(css) // 1024} KB, {users} pages")
+        if not dry_run and not css_paths[-1].exists():
+            write_text(css_paths[-1], css)
+    self_contained = [page.name for page, assigned in plan.items() if assigned is None]
+    if self_contained:
+        print(f"Kept all CSS inline (no shared file fits): {', '.join(self_contained)}")
+    if dry_run:
+        return
+
+    before = after = changed = 0
+    for page, html in sources.items():
+        if plan[page] is None:
+            markup = f'    <style id="page-css">{serialize(pages[page])}</style>\n'
+        else:
+            index, inline = plan[page]
+            href = site_relative(css_paths[index])
+            if page.parent != ROOT:
+                href = "../" * len(page.parent.relative_to(ROOT).parts) + href
+            critical = serialize(filter_rules(files[index], markup_names(above_the_fold(html))))
+            markup = stylesheet_markup(href, critical, serialize(inline))
+        text = rewrite_page(html, markup)
+        before += len(html.encode("utf-8"))
+        after += len(text.encode("utf-8"))
+        if write_if_changed(page, text):
+            changed += 1
+
+    # Old fingerprints are no longer linked from any page
+    for old in CSS_DIR.iterdir():
+        if HASHED_NAME.match(old.name) and old not in css_paths:
+            old.unlink()
+
+    print(f"Pages updated: {changed}, HTML {before // 1024} KB -> {after // 1024} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the shared Focal Psychology stylesheet")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report what would be shared without writing anything")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Stylesheet Builder")
+    print("=" * 60)
+    build(dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Web font builder for Focal Psychology
+Subsets Cormorant Garamond and Inter to the characters the pages actually use,
+self-hosts them as WOFF2 and replaces the Google Fonts links with preloads and
+inline @font-face rules
+"""
+
+import argparse
+import html
+import re
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fontTools import subset
+from fontTools.ttLib import TTFont
+from fontTools.varLib import instancer
+
+from build_search import text_of
+from site_build import ROOT, file_hash, page_paths, sha256_bytes, write_bytes, write_if_changed
+from site_markdown import Node, parse_html
+
+FONTS_DIR = ROOT / "fonts"
+SOURCE_DIR = FONTS_DIR / "src"
+SOURCE_URL = "https://raw.githubusercontent.com/google/fonts/main/ofl/{directory}/{file}"
+# Bump when subsetting options change so every font is rebuilt
+SUBSETTER_VERSION = 1
+
+# The faces the page CSS asks for, as the Google Fonts link did: family, style,
+# weights, google/fonts directory and variable source file
+FACES = (
+    ("Cormorant Garamond", "normal", (400, 600, 700), "cormorantgaramond", "CormorantGaramond[wght].ttf"),
+    ("Cormorant Garamond", "italic", (400,), "cormorantgaramond", "CormorantGaramond-Italic[wght].ttf"),
+    ("Inter", "normal", (300, 400, 500, 600), "inter", "Inter[opsz,wght].ttf"),
+)
+# Faces every page renders on first paint; the italic loads when a page needs it
+PRELOADED = {("Cormorant Garamond", "normal"), ("Inter", "normal")}
+# Always kept so code, numbers and punctuation typed later still render in the font
+BASE_CHARACTERS = {chr(c) for c in range(0x20, 0x7F)} | set("«»„“”‘’—–…№ ")
+
+TEXT_ATTRIBUTES = {"alt", "title", "placeholder", "aria-label", "value"}
+SCRIPT_STRING = re.compile(r"""(["'`])((?:\\.|(?!\1).)*)\1""", re.S)
+CSS_CONTENT = re.compile(r"""content:\s*(["'])(.*?)\1""")
+CSS_ESCAPE = re.compile(r"\\([0-9a-fA-F]{1,6})\s?")
+# What this tool replaces: the Google Fonts links, or its own earlier output
+FONT_MARKUP = re.compile(
+    r'[ \t]*(?:<link rel="preconnect" href="https://fonts\.(?:googleapis|gstatic)\.com"[^>]*>'
+    r'|<link href="https://fonts\.googleapis\.com/css2\?[^"]*" rel="stylesheet">'
+    r'|<link rel="preload" href="[^"]*fonts/[^"]+\.woff2"[^>]*>'
+    r'|<style id="font-faces">.*?</style>)[ \t]*\n?', re.S)
+
+
+def face_slug(family: str, style: str) -> str:
+    return family.lower().replace(" ", "-") + ("-italic" if style == "italic" else "")
+
+
+def page_characters(page: Path) -> set:
+    """Characters a page can render: its text, text attributes and the strings of its scripts and CSS"""
+    found = set()
+
+    def add_css(css: str):
+        for _, content in CSS_CONTENT.findall(css):
+            found.update(CSS_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), content))
+
+    def visit(node):
+        if isinstance(node, str) or not isinstance(node, Node):
+            return
+        for name, value in node.attrs:
+            if name in TEXT_ATTRIBUTES and value:
+                found.update(html.unescape(value))
+        if node.tag == "script":
+            for _, literal in SCRIPT_STRING.findall("".join(c for c in node.children if isinstance(c, str))):
+                found.update(literal)
+        elif node.tag == "style":
+            add_css("".join(c for c in node.children if isinstance(c, str)))
+        elif node.tag == "link":
+            # Shared stylesheets of build_css.py
+            href = dict(node.attrs).get("href") or ""
+            if href.endswith(".css") and "//" not in href and (page.parent / href).exists():
+                add_css((page.parent / href).read_text(encoding="utf-8"))
+        for child in node.children:
+            visit(child)
+
+    tree = parse_html(page.read_text(encoding="utf-8"))
+    found.update(html.unescape(text_of(tree)))
+    visit(tree)
+    return found
+
+
+def fetch_sources() -> None:
+    """Download the variable source fonts that are not in fonts/src yet"""
+    for family, style, _, directory, file in FACES:
+        target = SOURCE_DIR / file
+        if target.exists():
+            continue
+        url = SOURCE_URL.format(directory=directory, file=urllib.request.quote(file))
+        print(f"  Fetching: {url}")
+        with urllib.request.urlopen(url, timeout=60) as response:
+            write_bytes(target, response.read())
+
+
+def subset_face(source: Path, weights: tuple, text: str, target: Path) -> int:
+    """
+    Cut one variable font down to a WOFF2 of the given weights and characters;
+    runs in a worker process.
+
+    The weight axis is limited to the range the CSS uses (a single weight
+    becomes a static font); other axes are pinned to their defaults.
+    """
+    font = TTFont(source)
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = ["*"]
+    options.name_IDs = [1, 2]
+    options.hinting = False
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    # Instancing after subsetting: it is faster, and gvar of a range-limited font does not subset
+    if "fvar" in font:
+        limits = {axis.axisTag: None for axis in font["fvar"].axes}
+        limits["wght"] = (min(weights), max(weights)) if len(weights) > 1 else weights[0]
+        font = instancer.instantiateVariableFont(font, limits)
+    tmp = target.with_name(f".{target.name}.tmp")
+    subset.save_font(font, tmp, options)
+    tmp.replace(target)
+    return target.stat().st_size
+
+
+def build_fonts(characters: set, workers: int = None) -> list:
+    """
+    Subset every face whose output is missing; returns [(family, style,
+    weights, file)]. The file name carries a hash of source, characters and
+    subsetter settings, so a page only ever preloads the font it was built with.
+    """
+    FONTS_DIR.mkdir(exist_ok=True)
+    text = "".join(sorted(characters))
+    faces, pending = [], {}
+    for family, style, weights, _, file in FACES:
+        source = SOURCE_DIR / file
+        if not source.exists():
+            raise SystemExit(f"ERROR: missing {source}, run with --fetch to download it")
+        key = f"{SUBSETTER_VERSION}:{file_hash(source)}:{weights}:{text}"
+        target = FONTS_DIR / f"{face_slug(family, style)}.{sha256_bytes(key.encode('utf-8'))[:10]}.woff2"
+        faces.append((family, style, weights, target))
+        if not target.exists():
+            pending[target] = (source, weights)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {target: pool.submit(subset_face, source, weights, text, target)
+                   for target, (source, weights) in pending.items()}
+        for target, future in futures.items():
+            source = pending[target][0]
+            print(f"  Subset: {target.name} ({source.stat().st_size // 1024} KB -> "
+                  f"{future.result() // 1024} KB)")
+
+    # Old fingerprints are no longer linked from any page
+    current = {target for *_, target in faces}
+    for old in FONTS_DIR.glob("*.woff2"):
+        if old not in current:
+            old.unlink()
+    return faces
+
+
+def font_markup(faces: list, prefix: str) -> str:
+    """Preloads for the first-paint faces, then the @font-face rules"""
+    lines, rules = [], []
+    for family, style, weights, target in faces:
+        href = f"{prefix}fonts/{target.name}"
+        if (family, style) in PRELOADED:
+            lines.append(f'<link rel="preload" href="{href}" as="font" type="font/woff2" crossorigin>')
+        weight = f"{min(weights)} {max(weights)}" if len(weights) > 1 else str(weights[0])
+        rules.append(f"@font-face{{font-family:'{family}';font-style:{style};font-weight:{weight};"
+                     f"font-display:swap;src:url({href}) format('woff2')}}")
+    lines.append(f'<style id="font-faces">{"".join(rules)}</style>')
+    return "".join(f"    {line}\n" for line in lines)
+
+
+def rewrite_page(page_html: str, markup: str) -> str:
+    """Put `markup` where the page loads its fonts; pages without web fonts stay as they are"""
+    first = FONT_MARKUP.search(page_html)
+    if not first:
+        return page_html
+    rest = FONT_MARKUP.sub("", page_html[first.start():])
+    return page_html[:first.start()] + markup + rest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build self-hosted web fonts for Focal Psychology")
+    parser.add_argument("--fetch", action="store_true", help="download missing source fonts from google/fonts")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-html", action="store_true", help="only build the fonts, leave the pages alone")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Font Builder")
+    print("=" * 60)
+    if args.fetch:
+        fetch_sources()
+    pages = page_paths()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        characters = set(BASE_CHARACTERS).union(*pool.map(page_characters, pages, chunksize=4))
+    characters = {c for c in characters if c.isprintable() or c == " "}
+    print(f"Characters used: {len(characters)} "
+          f"({sum(1 for c in characters if 'А' <= c <= 'я' or c in 'Ёё')} Cyrillic letters)")
+    faces = build_fonts(characters, workers=args.jobs)
+    total = sum(target.stat().st_size for *_, target in faces)
+    print(f"Fonts: {len(faces)} files, {total // 1024} KB")
+    if args.no_html:
+        return
+
+    changed = 0
+    for page in pages:
+        prefix = "../" * len(page.parent.relative_to(ROOT).parts)
+        if write_if_changed(page, rewrite_page(page.read_text(encoding="utf-8"), font_markup(faces, prefix))):
+            changed += 1
+    print(f"Pages updated: {changed}")
+
+
+if __name__ == "__main__":
+    main()
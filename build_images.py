@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Responsive image builder for Focal Psychology
+Encodes every image in images/ as progressive JPEG, WebP and AVIF at several
+widths, with a tiny blurred placeholder, and rewrites the pages' <img> tags to
+use <picture>/srcset, intrinsic dimensions and lazy loading
+"""
+
+import argparse
+import base64
+import io
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageFilter, features
+
+try:
+    import pillow_avif  # noqa: F401  AVIF plugin for Pillow < 11.2
+except ImportError:
+    pass
+
+from site_build import (IMAGES_DIR, file_hash, load_json, page_paths, sha256_bytes, write_bytes,
+                        write_if_changed, write_json)
+
+OUTPUT_DIR = IMAGES_DIR / "responsive"
+MANIFEST_PATH = IMAGES_DIR / "manifest.json"
+# Bump when encoder settings change so every image is re-encoded
+ENCODER_VERSION = 2
+
+WIDTHS = (400, 600, 800, 1200)
+# format -> (file extension, MIME type, Pillow save options)
+FORMATS = {
+    "avif": ("avif", "image/avif", {"quality": 55, "speed": 6}),
+    "webp": ("webp", "image/webp", {"quality": 75, "method": 6}),
+    "jpeg": ("jpg", "image/jpeg", {"quality": 80, "progressive": True, "optimize": True}),
+}
+# Width of the inline placeholder; the browser upscales it into a soft blur
+PLACEHOLDER_WIDTH = 16
+# Image classes visible on first paint; everything else loads lazily
+ABOVE_THE_FOLD = {"hero-image", "chapter-image"}
+# Rendered width of each image class in the page CSS
+SIZES = {
+    "chapter-image": "(max-width: 600px) 100vw, 600px",
+    "topology-image": "(max-width: 450px) 100vw, 450px",
+    "hero-image": "100vw",
+}
+
+SOURCE_PATTERN = re.compile(r"^[\w-]+\.(jpg|jpeg|png)$")
+IMG_TAG = re.compile(r'<img\s[^>]*src="(?P<prefix>(?:\.\./)?images/)(?P<name>[^"/]+)"[^>]*>')
+PICTURE = re.compile(r'<picture>\s*(?:<source [^>]*>\s*)*(<img\s[^>]*>)\s*</picture>')
+ATTRIBUTE = re.compile(r'([\w-]+)(?:="([^"]*)")?')
+PLACEHOLDER_DECLARATIONS = re.compile(r"background-image:url\(data:[^)]*\);?|background-size:cover;?")
+
+
+def available_formats() -> list:
+    return [fmt for fmt in FORMATS if fmt == "jpeg" or features.check(fmt)]
+
+
+def source_images() -> list:
+    """Published images in images/, without generator candidates or build output"""
+    return sorted(p for p in IMAGES_DIR.iterdir()
+                  if p.is_file() and SOURCE_PATTERN.match(p.name))
+
+
+def target_widths(width: int) -> list:
+    return sorted({w for w in WIDTHS if w < width} | {min(width, max(WIDTHS))})
+
+
+def placeholder(image: Image.Image) -> str:
+    """Data URI of a tiny, slightly blurred WebP version of the image"""
+    width, height = image.size
+    small = image.resize((PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))),
+                         Image.BOX).filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    small.save(buffer, format="WEBP", quality=40)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def describe_image(source: Path) -> dict:
+    """Intrinsic size and placeholder of a source image; runs in a worker process"""
+    with Image.open(source) as image:
+        width, height = image.size
+        return {"width": width, "height": height, "placeholder": placeholder(image.convert("RGB"))}
+
+
+def encode_image(source: Path, formats: list) -> dict:
+    """
+    Encode one source image at every width and format; runs in a worker process.
+
+    File names carry a hash of their content, so they can be cached forever.
+    """
+    with Image.open(source) as image:
+        image.load()
+        width, height = image.size
+        image = image.convert("RGB")
+        preview = placeholder(image)
+        files = {fmt: [] for fmt in formats}
+        for target_width in target_widths(width):
+            target_height = round(height * target_width / width)
+            resized = (image if target_width == width
+                       else image.resize((target_width, target_height), Image.LANCZOS))
+            for fmt in formats:
+                extension, _, options = FORMATS[fmt]
+                buffer = io.BytesIO()
+                resized.save(buffer, format=fmt.upper(), **options)
+                data = buffer.getvalue()
+                name = f"{source.stem}-{target_width}.{sha256_bytes(data)[:10]}.{extension}"
+                write_bytes(OUTPUT_DIR / name, data)
+                files[fmt].append({"width": target_width, "file": f"responsive/{name}",
+                                   "bytes": len(data)})
+    return {"width": width, "height": height, "placeholder": preview, "files": files}
+
+
+def is_current(entry: dict, source_hash: str, formats: list) -> bool:
+    return (entry is not None
+            and entry.get("source_hash") == source_hash
+            and entry.get("encoder") == ENCODER_VERSION
+            and all(fmt in entry["files"] for fmt in formats)
+            and all((IMAGES_DIR / f["file"]).exists()
+                    for fmt in formats for f in entry["files"][fmt]))
+
+
+def build_manifest(force: bool = False, workers: int = None) -> dict:
+    """Re-encode images whose source hash changed; returns the manifest"""
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    formats = available_formats()
+    if "avif" not in formats:
+        print("WARNING: Pillow has no AVIF support, skipping AVIF (pip install pillow-avif-plugin)")
+
+    manifest = load_json(MANIFEST_PATH, {})
+    sources = source_images()
+    hashes = {source.name: file_hash(source) for source in sources}
+    stale = [s for s in sources
+             if force or not is_current(manifest.get(s.name), hashes[s.name], formats)]
+    print(f"Images: {len(sources)}, up to date: {len(sources) - len(stale)}, to encode: {len(stale)}")
+
+    # Entries from before placeholders existed only need the cheap part
+    undescribed = [s for s in sources
+                   if s not in stale and "placeholder" not in manifest[s.name]]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        described = {s.name: pool.submit(describe_image, s) for s in undescribed}
+        futures = {source.name: pool.submit(encode_image, source, formats) for source in stale}
+        for name, future in described.items():
+            manifest[name].update(future.result())
+        for name, future in futures.items():
+            entry = future.result()
+            entry.update(source_hash=hashes[name], encoder=ENCODER_VERSION)
+            manifest[name] = entry
+            original = (IMAGES_DIR / name).stat().st_size
+            largest = {fmt: entry["files"][fmt][-1]["bytes"] for fmt in formats}
+            sizes = ", ".join(f"{fmt} {size // 1024} KB" for fmt, size in largest.items())
+            print(f"  Encoded: {name} ({original // 1024} KB -> {sizes})")
+
+    # Forget images that were deleted
+    manifest = {name: entry for name, entry in manifest.items() if name in hashes}
+    write_json(MANIFEST_PATH, manifest)
+
+    # Encodings no manifest entry points at any more
+    current = {IMAGES_DIR / f["file"] for entry in manifest.values()
+               for files in entry["files"].values() for f in files}
+    for old in OUTPUT_DIR.iterdir():
+        if old.is_file() and old not in current:
+            old.unlink()
+    return manifest
+
+
+def parse_attributes(tag: str) -> dict:
+    inner = tag[len("<img"):-1].rstrip("/ ")
+    return {name: value for name, value in ATTRIBUTE.findall(inner)}
+
+
+def render_attributes(attributes: dict) -> str:
+    return " ".join(f'{name}="{value}"' if value != "" else name
+                    for name, value in attributes.items())
+
+
+def srcset(prefix: str, files: list) -> str:
+    return ", ".join(f"{prefix}{f['file']} {f['width']}w" for f in files)
+
+
+def placeholder_style(style: str, entry: dict) -> str:
+    """Existing inline style with our placeholder background swapped in"""
+    own = PLACEHOLDER_DECLARATIONS.sub("", style).strip().strip(";")
+    ours = f"background-image:url({entry['placeholder']});background-size:cover"
+    return f"{own};{ours}" if own else ours
+
+
+def picture_markup(img_tag: str, prefix: str, entry: dict) -> str:
+    """
+    <picture> with AVIF/WebP sources and a JPEG srcset fallback for one <img>.
+
+    The <img> gets its intrinsic width/height so its box is reserved before
+    it loads, the blurred placeholder as background, and loading hints:
+    above-the-fold images are fetched eagerly at high priority, the rest lazily.
+    """
+    attributes = parse_attributes(img_tag)
+    image_class = attributes.get("class", "")
+    sizes = SIZES.get(image_class, "100vw")
+    attributes["srcset"] = srcset(prefix, entry["files"]["jpeg"])
+    attributes["sizes"] = sizes
+    attributes["width"] = str(entry["width"])
+    attributes["height"] = str(entry["height"])
+    attributes["decoding"] = "async"
+    if image_class in ABOVE_THE_FOLD:
+        attributes["loading"] = "eager"
+        attributes["fetchpriority"] = "high"
+    else:
+        attributes["loading"] = "lazy"
+        attributes.pop("fetchpriority", None)
+    attributes["style"] = placeholder_style(attributes.get("style", ""), entry)
+    sources = "".join(
+        f'<source type="{FORMATS[fmt][1]}" srcset="{srcset(prefix, entry["files"][fmt])}" '
+        f'sizes="{sizes}">'
+        for fmt in ("avif", "webp") if fmt in entry["files"])
+    return f"<picture>{sources}<img {render_attributes(attributes)}></picture>"
+
+
+def rewrite_page(html: str, manifest: dict) -> str:
+    """Point every managed <img> at its responsive files; safe to run repeatedly"""
+    html = PICTURE.sub(lambda m: m.group(1), html)
+
+    def replace(match):
+        entry = manifest.get(match.group("name"))
+        if entry is None:
+            return match.group(0)
+        return picture_markup(match.group(0), match.group("prefix"), entry)
+
+    return IMG_TAG.sub(replace, html)
+
+
+def rewrite_pages(manifest: dict) -> int:
+    changed = 0
+    for page in page_paths():
+        html = page.read_text(encoding="utf-8")
+        if write_if_changed(page, rewrite_page(html, manifest)):
+            changed += 1
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build responsive images for Focal Psychology")
+    parser.add_argument("--force", action="store_true", help="re-encode every image")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-html", action="store_true", help="only encode, leave the pages alone")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Image Builder")
+    print("=" * 60)
+    manifest = build_manifest(force=args.force, workers=args.jobs)
+    if not args.no_html:
+        print(f"Pages updated: {rewrite_pages(manifest)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Search index builder for Focal Psychology
+Stems the Russian text of every chapter section into an inverted index split
+into small shards by term prefix, so the browser fetches only what a query needs
+"""
+
+import argparse
+import html
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from site_build import CHAPTERS_DIR, ROOT, sha256_bytes, site_relative, write_if_changed
+from site_markdown import Comment, parse_html
+
+SEARCH_DIR = ROOT / "search"
+META_PATH = SEARCH_DIR / "meta.json"
+# Bump when tokenizing or the file format changes; the page script checks it
+INDEX_VERSION = 1
+# Characters of a term that pick its shard; shards over the size limit split on one more
+PREFIX_LENGTH = 2
+MAX_SHARD_BYTES = 4 * 1024
+MIN_TOKEN_LENGTH = 2
+
+TOKEN = re.compile(r"[а-яёa-z0-9]+(?:-[а-яёa-z0-9]+)*")
+MAIN = re.compile(r'<main class="chapter-content">(.*)</main>', re.S)
+SECTION_HEADING = re.compile(r"<h2\b([^>]*)>")
+ID_ATTRIBUTE = re.compile(r'\bid="([^"]*)"')
+TITLE = re.compile(r'<h1 class="chapter-title">(.*?)</h1>', re.S)
+SKIPPED_TAGS = {"script", "style", "svg"}
+
+# Words too common to narrow down a search
+STOP_WORDS = set("""
+а без более бы был была были было быть в вам вас весь во вот все всё всего всех вы где да даже
+для до его ее её ей ему если есть еще ещё же за здесь и из или им их к как ко когда кто ли либо
+мне может мы на над надо не него нее неё нет ни них но ну о об однако он она они оно от очень
+по под при с со так также такой там те тем то того тоже той только том ты у уже хотя чего чей
+чем что чтобы чье чьё эта эти это этого этой этом этот я
+""".split())
+
+# Snowball Russian stemmer; the page script has the same rules in JavaScript
+VOWELS = "аеиоуыэюя"
+RV = re.compile(rf"^(.*?[{VOWELS}])(.*)$")
+PERFECTIVE_GERUND = re.compile(r"(?:ив|ивши|ившись|ыв|ывши|ывшись|(?<=[ая])(?:в|вши|вшись))$")
+REFLEXIVE = re.compile(r"(?:ся|сь)$")
+ADJECTIVE = re.compile(r"(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю"
+                       r"|ая|яя|ою|ею)$")
+PARTICIPLE = re.compile(r"(?:ивш|ывш|ующ|(?<=[ая])(?:ем|нн|вш|ющ|щ))$")
+VERB = re.compile(r"(?:ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют"
+                  r"|ит|ыт|ены|ить|ыть|ишь|ую|ю|(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют"
+                  r"|ны|ть|ешь|нно))$")
+NOUN = re.compile(r"(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у"
+                  r"|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+DERIVATIONAL_CONTEXT = re.compile(rf"[^{VOWELS}][{VOWELS}].*ость?$")
+DERIVATIONAL = re.compile(r"ость?$")
+SUPERLATIVE = re.compile(r"(?:ейше|ейш)$")
+
+
+def stem(word: str) -> str:
+    """Snowball stem of a lowercase Russian word; other words come back unchanged"""
+    match = RV.match(word)
+    if not match or not re.search("[а-я]", word):
+        return word
+    start, rv = match.groups()
+    stripped = PERFECTIVE_GERUND.sub("", rv, count=1)
+    if stripped == rv:
+        rv = REFLEXIVE.sub("", rv, count=1)
+        stripped = ADJECTIVE.sub("", rv, count=1)
+        if stripped != rv:
+            rv = PARTICIPLE.sub("", stripped, count=1)
+        else:
+            stripped = VERB.sub("", rv, count=1)
+            rv = NOUN.sub("", rv, count=1) if stripped == rv else stripped
+    else:
+        rv = stripped
+    if rv.endswith("и"):
+        rv = rv[:-1]
+    if DERIVATIONAL_CONTEXT.search(rv):
+        rv = DERIVATIONAL.sub("", rv, count=1)
+    if rv.endswith("ь"):
+        rv = rv[:-1]
+    else:
+        rv = SUPERLATIVE.sub("", rv, count=1)
+        if rv.endswith("нн"):
+            rv = rv[:-1]
+    return start + rv
+
+
+def terms(text: str) -> list:
+    """Stemmed index terms of a text, in order, without stop words"""
+    out = []
+    for token in TOKEN.findall(text.lower().replace("ё", "е")):
+        for word in token.split("-"):
+            if len(word) >= MIN_TOKEN_LENGTH and word not in STOP_WORDS:
+                out.append(stem(word))
+    return out
+
+
+def text_of(node) -> str:
+    if isinstance(node, Comment):
+        return ""
+    if isinstance(node, str):
+        return node
+    if node.tag in SKIPPED_TAGS:
+        return ""
+    return " ".join(text_of(child) for child in node.children)
+
+
+def plain_text(markup: str) -> str:
+    return re.sub(r"\s+", " ", html.unescape(text_of(parse_html(markup)))).strip()
+
+
+def with_section_ids(page_html: str) -> str:
+    """Give every section heading of the chapter an id the index can link to"""
+    main = MAIN.search(page_html)
+    if not main:
+        return page_html
+    count = 0
+
+    def add_id(match):
+        nonlocal count
+        count += 1
+        if ID_ATTRIBUTE.search(match.group(1)):
+            return match.group(0)
+        return f'<h2 id="s{count}"{match.group(1)}>'
+
+    content = SECTION_HEADING.sub(add_id, main.group(1))
+    return page_html[:main.start(1)] + content + page_html[main.end(1):]
+
+
+def chapter_sections(page: Path):
+    """
+    Split one chapter into searchable sections; runs in a worker process.
+
+    Returns (html with section ids, [(anchor, section title, terms)]). Text
+    before the first <h2> belongs to the chapter itself (empty anchor).
+    """
+    page_html = with_section_ids(page.read_text(encoding="utf-8"))
+    main = MAIN.search(page_html)
+    if not main:
+        return page_html, "", []
+    title = TITLE.search(page_html)
+    chapter_title = plain_text(title.group(1)) if title else page.stem
+    content = main.group(1)
+    starts = [m.start() for m in SECTION_HEADING.finditer(content)]
+    sections = []
+    for start, end in zip([0] + starts, starts + [len(content)]):
+        chunk = content[start:end]
+        heading = SECTION_HEADING.match(chunk)
+        anchor = ID_ATTRIBUTE.search(heading.group(1)).group(1) if heading else ""
+        section_title = plain_text(chunk[:chunk.find("</h2>")]) if heading else chapter_title
+        words = terms(chapter_title + " " + plain_text(chunk) if not heading else plain_text(chunk))
+        if words:
+            sections.append((anchor, section_title, words))
+    return page_html, chapter_title, sections
+
+
+def encode_postings(postings: list) -> str:
+    """[(doc, tf)] sorted by doc -> "gap[.tf],..." in base 36, tf omitted when 1"""
+    out, previous = [], 0
+    for doc, tf in postings:
+        gap = base36(doc - previous)
+        out.append(gap if tf == 1 else f"{gap}.{base36(tf)}")
+        previous = doc
+    return ",".join(out)
+
+
+def base36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if n == 0:
+            return out
+
+
+def shard_file(prefix: str) -> Path:
+    return SEARCH_DIR / f"{prefix.encode('utf-8').hex()}.json"
+
+
+def compact_json(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def shard_terms(postings: dict) -> dict:
+    """
+    Group encoded postings into prefix -> {term: postings} shards.
+
+    A term lives in the shard of the longest listed prefix it starts with,
+    which is how the page script finds it again.
+    """
+    shards = {}
+    pending = {}
+    for term, encoded in postings.items():
+        pending.setdefault(term[:PREFIX_LENGTH], {})[term] = encoded
+    while pending:
+        prefix, shard = pending.popitem()
+        longer = {t: p for t, p in shard.items() if len(t) > len(prefix)}
+        if len(compact_json(shard).encode("utf-8")) <= MAX_SHARD_BYTES or not longer:
+            shards[prefix] = shard
+            continue
+        rest = {t: p for t, p in shard.items() if len(t) <= len(prefix)}
+        if rest:
+            shards[prefix] = rest
+        for term, encoded in longer.items():
+            pending.setdefault(term[:len(prefix) + 1], {})[term] = encoded
+    return shards
+
+
+def build(workers: int = None, rewrite: bool = True) -> None:
+    pages = sorted(CHAPTERS_DIR.glob("*.html"))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(chapter_sections, pages, chunksize=4))
+
+    docs = []
+    index = {}  # term -> {doc: tf}
+    ids_added = 0
+    for page, (page_html, chapter_title, sections) in zip(pages, results):
+        if rewrite and write_if_changed(page, page_html):
+            ids_added += 1
+        href = site_relative(page)
+        for anchor, section_title, words in sections:
+            doc = len(docs)
+            docs.append([href, anchor, chapter_title, section_title, len(words)])
+            for word in words:
+                counts = index.setdefault(word, {})
+                counts[doc] = counts.get(doc, 0) + 1
+
+    shards = shard_terms({term: encode_postings(sorted(counts.items()))
+                          for term, counts in index.items()})
+    texts = {prefix: compact_json(shard) for prefix, shard in shards.items()}
+    written = sum(write_if_changed(shard_file(prefix), text) for prefix, text in texts.items())
+    current = {shard_file(prefix) for prefix in shards}
+    for old in SEARCH_DIR.glob("*.json"):
+        if old != META_PATH and old not in current:
+            old.unlink()
+
+    # The page script adds the build id to shard URLs so a cached shard never mixes with a new build
+    build_id = sha256_bytes(compact_json([docs, texts]).encode("utf-8"))[:10]
+    write_if_changed(META_PATH, compact_json({"version": INDEX_VERSION, "build": build_id,
+                                              "shards": sorted(shards), "docs": docs}))
+
+    sizes = sorted(len(text.encode("utf-8")) for text in texts.values())
+    print(f"Sections: {len(docs)}, terms: {len(index)}, meta.json: {META_PATH.stat().st_size // 1024} KB")
+    print(f"Shards: {len(shards)} (median {sizes[len(sizes) // 2]} B, largest {sizes[-1]} B), "
+          f"updated: {written}")
+    if rewrite:
+        print(f"Pages given section ids: {ids_added}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Focal Psychology search index")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-html", action="store_true", help="index only, leave the pages alone")
+    parser.add_argument("--query", metavar="TEXT", help="print the terms a query is stemmed to and exit")
+    args = parser.parse_args()
+
+    if args.query:
+        print(" ".join(terms(args.query)))
+        return
+    print("=" * 60)
+    print("Focal Psychology Search Index Builder")
+    print("=" * 60)
+    build(workers=args.jobs, rewrite=not args.no_html)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Sitemap builder for Focal Psychology
+Writes sitemap.xml for every page with an entry for each image it shows;
+a page's lastmod moves only when the hash of its content changes
+"""
+
+import argparse
+import html
+import re
+from datetime import date
+
+from build_images import IMAGES_DIR, IMG_TAG
+from build_search import plain_text
+from build_techniques import book_parts
+from site_build import (INDEX_PAGE, ROOT, SITE_URL, load_json, page_paths, sha256_bytes, site_relative,
+                        write_if_changed, write_json)
+
+SITEMAP_PATH = ROOT / "sitemap.xml"
+# Content hash and lastmod of every page; commit it with sitemap.xml so dates survive a fresh checkout
+STORE_PATH = ROOT / "sitemap.lastmod.json"
+INTRO = "chapters/intro.html"
+
+TITLE = re.compile(r"<title>(.*?)</title>", re.S)
+DESCRIPTION = re.compile(r'<meta name="description" content="([^"]*)"')
+BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S)
+OLD_ENTRY = re.compile(r"<loc>([^<]+)</loc>\s*<lastmod>([^<]+)</lastmod>")
+
+
+def content_hash(page_html: str) -> str:
+    """
+    Hash of what a reader gets from a page: title, description, text and images.
+
+    Markup the build steps rewrite (styles, fonts, ids, <picture>, scripts)
+    does not count, so rebuilding the site leaves lastmod alone.
+    """
+    title = TITLE.search(page_html)
+    description = DESCRIPTION.search(page_html)
+    body = BODY.search(page_html)
+    parts = [
+        plain_text(title.group(1)) if title else "",
+        html.unescape(description.group(1)) if description else "",
+        plain_text(body.group(1) if body else page_html),
+        " ".join(match.group("name") for match in IMG_TAG.finditer(page_html)),
+    ]
+    return sha256_bytes("\n".join(parts).encode("utf-8"))
+
+
+def page_url(href: str) -> str:
+    return f"{SITE_URL}/" if href == site_relative(INDEX_PAGE) else f"{SITE_URL}/{href}"
+
+
+def sitemap_order(pages: dict) -> list:
+    """[(comment or None, href)]: the start page, the introduction, then the chapters part by part"""
+    parts, toc = book_parts()
+    order = [("Main Page", site_relative(INDEX_PAGE)), ("Introduction", INTRO)]
+    previous = None
+    for href, (part, _, _) in toc.items():
+        label = f"{parts[part]['key']}: {parts[part]['title']}" if part != previous else None
+        order.append((label, href))
+        previous = part
+    listed = {href for _, href in order}
+    order += [(None, href) for href in pages if href not in listed]
+    return [(label, href) for label, href in order if href in pages]
+
+
+def url_entry(href: str, lastmod: str, images: list) -> str:
+    if href == site_relative(INDEX_PAGE):
+        changefreq, priority = "weekly", "1.0"
+    else:
+        changefreq, priority = "monthly", "0.9" if href == INTRO else "0.8"
+    lines = ["    <url>",
+             f"        <loc>{html.escape(page_url(href))}</loc>",
+             f"        <lastmod>{lastmod}</lastmod>",
+             f"        <changefreq>{changefreq}</changefreq>",
+             f"        <priority>{priority}</priority>"]
+    for image in images:
+        lines += ["        <image:image>",
+                  f"            <image:loc>{html.escape(f'{SITE_URL}/images/{image}')}</image:loc>",
+                  "        </image:image>"]
+    lines.append("    </url>")
+    return "\n".join(lines)
+
+
+def build(today: str) -> None:
+    sources = {site_relative(page): page.read_text(encoding="utf-8") for page in page_paths()}
+    # The originals in images/, not build_images.py output, so a source checkout gets the same sitemap
+    image_files = {path.name for path in IMAGES_DIR.iterdir() if path.is_file()}
+
+    # Pages the hand-written sitemap already had keep its dates
+    store = load_json(STORE_PATH, {})
+    if not store and SITEMAP_PATH.exists():
+        old = dict(OLD_ENTRY.findall(SITEMAP_PATH.read_text(encoding="utf-8")))
+        store = {href: {"hash": None, "lastmod": old[page_url(href)]}
+                 for href in sources if page_url(href) in old}
+
+    changed = []
+    for href, page_html in sources.items():
+        digest = content_hash(page_html)
+        entry = store.get(href)
+        if entry is None or entry["hash"] not in (digest, None):
+            store[href] = {"hash": digest, "lastmod": today}
+            changed.append(href)
+        elif entry["hash"] is None:
+            entry["hash"] = digest
+    store = {href: entry for href, entry in store.items() if href in sources}
+
+    entries, image_count = [], 0
+    for label, href in sitemap_order(sources):
+        images = list(dict.fromkeys(match.group("name") for match in IMG_TAG.finditer(sources[href])
+                                    if match.group("name") in image_files))
+        image_count += len(images)
+        if label:
+            entries.append(f"\n    <!-- {html.escape(label)} -->")
+        entries.append(url_entry(href, store[href]["lastmod"], images))
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"\n'
+           '        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">'
+           + "\n".join(entries) + "\n</urlset>\n")
+    write_if_changed(SITEMAP_PATH, xml)
+    write_json(STORE_PATH, store)
+
+    print(f"Pages: {len(sources)}, images: {image_count}, lastmod moved: {len(changed)}")
+    for href in changed:
+        print(f"  Changed: {href}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build sitemap.xml for Focal Psychology")
+    parser.add_argument("--date", default=date.today().isoformat(),
+                        help="lastmod for changed pages, YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Sitemap Builder")
+    print("=" * 60)
+    build(args.date)
+
+
+if __name__ == "__main__":
+    main()
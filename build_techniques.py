@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Technique catalogue builder for Focal Psychology
+Extracts every technique card of the chapters into a small columnar dataset with
+facet indexes by part, duration and layer, plus per-chapter files with the steps
+"""
+
+import argparse
+import html
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from build_search import compact_json, text_of
+from site_build import CHAPTERS_DIR, INDEX_PAGE, ROOT, sha256_bytes, site_relative, write_if_changed
+from site_markdown import Node, parse_html
+
+CATALOGUE_DIR = ROOT / "techniques"
+CATALOGUE_PATH = CATALOGUE_DIR / "catalogue.json"
+# Bump when extraction or the file format changes; the page script checks it
+CATALOGUE_VERSION = 1
+
+CARD_CLASSES = {"technique-card", "technique"}
+META_CLASSES = {"technique-meta", "meta-info"}
+STEP_CLASSES = {"step", "step-item"}
+STEP_TEXT_CLASSES = {"step-content", "step-text"}
+OBSERVATION_CLASSES = {"observation", "observation-box", "observation-block", "observe-box",
+                       "technique-observe"}
+OBSERVATION_HEADINGS = {"observation-label", "observation-title"}
+SUMMARY_CLASSES = {"technique-purpose", "technique-intro"}
+
+CARD_TAG = re.compile(r'(<div class="(?:technique-card(?: fade-in)?|technique)")([^>]*)>')
+ID_ATTRIBUTE = re.compile(r'\bid="([^"]*)"')
+MAIN = re.compile(r'<main class="chapter-content">(.*)</main>', re.S)
+# "Техника 27.1: Вход в Мастерскую" -> number and title
+NUMBERED_TITLE = re.compile(r"^(?:Техника|Практика|Упражнение)?\s*(\d+[\w.]*)[:.]?\s+(.+)$")
+NUMBER_PREFIX = re.compile(r"^(?:Техника|Практика|Упражнение)\s+")
+PART_CARD = re.compile(r'<div class="part-number"[^>]*>(.*?)</div>.*?<h3>(.*?)</h3>(.*?)(?=<div class="part-card|$)',
+                       re.S)
+CHAPTER_ITEM = re.compile(r'<a href="(chapters/[^"]+)" class="chapter-item"><span class="chapter-num">([^<]*)</span>'
+                          r'<span class="chapter-title">([^<]*)</span>')
+
+# Meta items that state how long a technique takes, by label or icon
+TIME_LABEL = re.compile(r"^(?:⏱|Время|Длительность|На переход|На проверку)", re.I)
+DURATION = re.compile(r"(\d+)(?:\s*[-–—]\s*(\d+))?\s*(сек|мин|час|д[не]|недел|месяц)", re.I)
+INSTANT = re.compile(r"мгновенн", re.I)
+ONGOING = re.compile(r"в течение|день|дня|дней|недел|месяц|постоянно|ежедневно", re.I)
+MINUTES = {"сек": 1 / 60, "мин": 1, "час": 60, "дн": 24 * 60, "де": 24 * 60,
+           "недел": 7 * 24 * 60, "месяц": 30 * 24 * 60}
+# Duration buckets by the longest stated time, in minutes; techniques that run
+# over days or through the day are "ongoing"
+DURATION_BUCKETS = (
+    ("5", "до 5 минут", 5),
+    ("10", "до 10 минут", 10),
+    ("20", "до 20 минут", 20),
+    ("30", "до 30 минут", 30),
+    ("60", "до часа", 60),
+    ("long", "больше часа", 24 * 60 - 1),
+)
+ONGOING_BUCKET = ("ongoing", "в течение дня и дольше")
+UNKNOWN_BUCKET = ("unknown", "время не указано")
+
+# Layers of the topology (see the index page) with the chapter that describes
+# each; a technique belongs to its chapter's layer and to every layer it names
+LAYERS = (
+    ("0", "Колыбель", "22", re.compile(r"колыбел", re.I)),
+    ("1", "Театр внутри", "23", re.compile(r"театр[а-яё]* внутри", re.I)),
+    ("2", "Граница сна", "24", re.compile(r"границ[а-яё]* сна", re.I)),
+    ("3", "Театр масок", "25", re.compile(r"театр[а-яё]* масок", re.I)),
+    ("4", "Междумирье", "26", re.compile(r"междумир", re.I)),
+    ("5", "Лимб / Мастерская", "27", re.compile(r"\bлимб|мастерск", re.I)),
+)
+
+
+def classes(node) -> set:
+    if not isinstance(node, Node):
+        return set()
+    return set((dict(node.attrs).get("class") or "").split())
+
+
+def elements(node):
+    return [child for child in node.children if isinstance(child, Node)]
+
+
+def find_all(node, match, stop=lambda n: False):
+    """Descendant elements for which match() holds, not looking inside matches or stop() nodes"""
+    out = []
+    for child in elements(node):
+        if match(child):
+            out.append(child)
+        elif not stop(child):
+            out.extend(find_all(child, match, stop))
+    return out
+
+
+def find_first(node, match, stop=lambda n: False):
+    found = find_all(node, match, stop)
+    return found[0] if found else None
+
+
+def has_class(names: set):
+    return lambda node: bool(classes(node) & names)
+
+
+def clean(text: str) -> str:
+    return re.sub(r"\s+", " ", html.unescape(text)).strip()
+
+
+def text(node) -> str:
+    return clean(text_of(node)) if node is not None else ""
+
+
+def meta_items(card: Node) -> list:
+    """Texts of the card's meta line: "Время: 30-40 минут", "⏱️ 15-20 минут", ..."""
+    items = []
+    for meta in find_all(card, has_class(META_CLASSES)):
+        for item in elements(meta):
+            label = find_first(item, has_class({"meta-label"}))
+            value = find_first(item, has_class({"meta-value"}))
+            items.append(f"{text(label)}: {text(value)}" if label and value else text(item))
+    return [item for item in items if item]
+
+
+def duration(meta: list):
+    """(min, max) minutes of the first time meta item, "ongoing", or None"""
+    timed = [item for item in meta if TIME_LABEL.match(item)]
+    for item in timed or [item for item in meta if DURATION.search(item)][:1]:
+        match = DURATION.search(item)
+        if match:
+            unit = next(factor for prefix, factor in MINUTES.items()
+                        if match.group(3).lower().startswith(prefix))
+            low = int(match.group(1)) * unit
+            high = int(match.group(2) or match.group(1)) * unit
+            if high >= 24 * 60:
+                return "ongoing"
+            return round(low, 2), round(high, 2)
+        if INSTANT.search(item):
+            return 0, 1
+        if ONGOING.search(item):
+            return "ongoing"
+    return None
+
+
+def duration_bucket(minutes) -> str:
+    if minutes is None:
+        return UNKNOWN_BUCKET[0]
+    if minutes == "ongoing":
+        return ONGOING_BUCKET[0]
+    return next(key for key, _, limit in DURATION_BUCKETS if minutes[1] <= limit)
+
+
+def steps(card: Node) -> list:
+    """Step texts, from <div class="step"> blocks or the card's first list"""
+    inside = has_class(OBSERVATION_CLASSES)
+    blocks = find_all(card, has_class(STEP_CLASSES), stop=inside)
+    if blocks:
+        out = []
+        for block in blocks:
+            body = find_first(block, has_class(STEP_TEXT_CLASSES))
+            if body is None:
+                body = Node(block.tag, [], False)
+                body.children = [c for c in block.children if "step-number" not in classes(c)]
+            out.append(text(body))
+        return [step for step in out if step]
+    listing = find_first(card, lambda n: n.tag in ("ol", "ul"), stop=inside)
+    if listing is None:
+        return []
+    return [text(item) for item in elements(listing) if item.tag == "li" and text(item)]
+
+
+def observation(card: Node) -> str:
+    """What to watch for, without its "Что наблюдать" heading"""
+    box = find_first(card, has_class(OBSERVATION_CLASSES))
+    if box is None:
+        return ""
+    body = Node(box.tag, [], False)
+    body.children = [c for c in box.children
+                     if not (isinstance(c, Node) and (re.fullmatch(r"h[2-6]", c.tag)
+                                                       or classes(c) & OBSERVATION_HEADINGS))]
+    result = text(body)
+    first = find_first(body, lambda n: n.tag in ("strong", "b"))
+    if first is not None and text(first).endswith(":") and result.startswith(text(first)):
+        result = result[len(text(first)):].strip()
+    return result
+
+
+def summary(card: Node) -> str:
+    """The card's purpose line, or its first paragraph"""
+    purpose = find_first(card, has_class(SUMMARY_CLASSES))
+    if purpose is not None:
+        return text(purpose)
+    body = find_first(card, has_class({"technique-content"})) or card
+    first = next((child for child in elements(body) if child.tag == "p"), None)
+    return text(first)
+
+
+def number_and_title(card: Node, chapter_number: str, ordinal: int):
+    """
+    Qualified number ("27.1") and title of a card.
+
+    Cards number themselves "8.3", "1" (within the chapter), or only in the
+    title ("Техника 27.1: ..."); unnumbered cards get their position.
+    """
+    number = NUMBER_PREFIX.sub("", text(find_first(card, has_class({"technique-number"}))))
+    title = text(find_first(card, has_class({"technique-title"})))
+    match = NUMBERED_TITLE.match(title)
+    if match and re.match(r"\d", match.group(1)) and not number:
+        number, title = match.group(1).rstrip("."), match.group(2)
+    if not number:
+        number = str(ordinal)
+    if "." not in number and chapter_number:
+        number = f"{chapter_number}.{number}"
+    return number, title
+
+
+def with_card_ids(page_html: str) -> str:
+    """Give every technique card of the chapter an id the catalogue can link to"""
+    main = MAIN.search(page_html)
+    if not main:
+        return page_html
+    count = 0
+
+    def add_id(match):
+        nonlocal count
+        count += 1
+        if ID_ATTRIBUTE.search(match.group(2)):
+            return match.group(0)
+        return f'{match.group(1)} id="t{count}"{match.group(2)}>'
+
+    content = CARD_TAG.sub(add_id, main.group(1))
+    return page_html[:main.start(1)] + content + page_html[main.end(1):]
+
+
+def layers(chapter_stem: str, card_text: str) -> list:
+    return [key for key, _, chapter, pattern in LAYERS
+            if chapter_stem == chapter or pattern.search(card_text)]
+
+
+def chapter_techniques(page: Path, chapter_number: str):
+    """
+    Extract the technique cards of one chapter; runs in a worker process.
+
+    Returns (html with card ids, [technique]).
+    """
+    page_html = with_card_ids(page.read_text(encoding="utf-8"))
+    main = MAIN.search(page_html)
+    if not main:
+        return page_html, []
+    cards = find_all(parse_html(main.group(1)), has_class(CARD_CLASSES))
+    techniques = []
+    for ordinal, card in enumerate(cards, 1):
+        number, title = number_and_title(card, chapter_number, ordinal)
+        meta = meta_items(card)
+        techniques.append({
+            "anchor": dict(card.attrs).get("id", ""),
+            "number": number,
+            "title": title,
+            "summary": summary(card),
+            "meta": meta,
+            "duration": duration(meta),
+            "steps": steps(card),
+            "observation": observation(card),
+            "layers": layers(page.stem, text(card)),
+        })
+    return page_html, techniques
+
+
+def book_parts() -> tuple:
+    """Parts of the book from the index page, and chapter href -> (part, chapter number, title)"""
+    parts, chapters = [], {}
+    index_html = INDEX_PAGE.read_text(encoding="utf-8")
+    for number, title, items in PART_CARD.findall(index_html):
+        parts.append({"key": clean(re.sub(r"<[^>]+>", "", number)), "title": clean(title)})
+        for href, chapter_number, chapter_title in CHAPTER_ITEM.findall(items):
+            chapters[href] = (len(parts) - 1, clean(chapter_number), clean(chapter_title))
+    return parts, chapters
+
+
+def facet(values: list) -> dict:
+    """value -> sorted row numbers; rows with several values appear under each"""
+    index = {}
+    for row, keys in enumerate(values):
+        for key in keys if isinstance(keys, list) else [keys]:
+            index.setdefault(str(key), []).append(row)
+    return index
+
+
+def build(workers: int = None, rewrite: bool = True) -> None:
+    parts, toc = book_parts()
+    pages = sorted(CHAPTERS_DIR.glob("*.html"))
+    numbers = [toc.get(site_relative(page), (None, "", ""))[1] for page in pages]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(chapter_techniques, pages, numbers, chunksize=4))
+
+    chapters, rows, details = [], [], {}
+    ids_added = 0
+    for page, (page_html, techniques) in zip(pages, results):
+        if rewrite and write_if_changed(page, page_html):
+            ids_added += 1
+        if not techniques:
+            continue
+        href = site_relative(page)
+        part, chapter_number, chapter_title = toc.get(href, (None, "", page.stem))
+        chapters.append([href, chapter_number, chapter_title, part])
+        details[page.stem] = [{key: t[key] for key in ("number", "summary", "meta", "steps", "observation")}
+                              for t in techniques]
+        for position, technique in enumerate(techniques):
+            rows.append(dict(technique, chapter=len(chapters) - 1, part=part, position=position))
+
+    # Column per field: the filter page needs only this file
+    minutes = [row["duration"] if isinstance(row["duration"], tuple) else None for row in rows]
+    columns = {
+        "chapter": [row["chapter"] for row in rows],
+        "anchor": [row["anchor"] for row in rows],
+        "number": [row["number"] for row in rows],
+        "title": [row["title"] for row in rows],
+        "min": [m[0] if m else None for m in minutes],
+        "max": [m[1] if m else None for m in minutes],
+        "steps": [len(row["steps"]) for row in rows],
+    }
+    buckets = [duration_bucket(row["duration"]) for row in rows]
+    facets = {
+        "part": facet([parts[row["part"]]["key"] if row["part"] is not None else "" for row in rows]),
+        "duration": facet(buckets),
+        "layer": facet([row["layers"] for row in rows]),
+    }
+    texts = {stem: compact_json(entries) for stem, entries in details.items()}
+    written = sum(write_if_changed(CATALOGUE_DIR / f"{stem}.json", text) for stem, text in texts.items())
+    for old in CATALOGUE_DIR.glob("*.json"):
+        if old != CATALOGUE_PATH and old.stem not in texts:
+            old.unlink()
+
+    # The page script adds the build id to detail URLs so a cached file never mixes with a new build
+    build_id = sha256_bytes(compact_json([columns, texts]).encode("utf-8"))[:10]
+    catalogue = {
+        "version": CATALOGUE_VERSION,
+        "build": build_id,
+        "count": len(rows),
+        "chapters": chapters,
+        "parts": parts,
+        "durations": [{"key": key, "title": title} for key, title, _ in DURATION_BUCKETS]
+                     + [{"key": key, "title": title} for key, title in (ONGOING_BUCKET, UNKNOWN_BUCKET)],
+        "layers": [{"key": key, "title": title} for key, title, _, _ in LAYERS],
+        "columns": columns,
+        "facets": facets,
+    }
+    write_if_changed(CATALOGUE_PATH, compact_json(catalogue))
+
+    counts = {key: len(rows_) for key, rows_ in facets["duration"].items()}
+    print(f"Techniques: {len(rows)} in {len(chapters)} chapters, "
+          f"catalogue.json: {CATALOGUE_PATH.stat().st_size // 1024} KB, chapter files updated: {written}")
+    print("By duration: " + ", ".join(f"{key} {counts.get(key, 0)}" for key, *_ in
+                                     DURATION_BUCKETS + (ONGOING_BUCKET, UNKNOWN_BUCKET)))
+    if rewrite:
+        print(f"Pages given card ids: {ids_added}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Focal Psychology technique catalogue")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-html", action="store_true", help="catalogue only, leave the pages alone")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Technique Catalogue Builder")
+    print("=" * 60)
+    build(workers=args.jobs, rewrite=not args.no_html)
+
+
+if __name__ == "__main__":
+    main()
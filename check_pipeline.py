@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Scripted checks of the generation pipeline for Focal Psychology
+Runs run_pipeline against fake ComfyUI servers with injected faults and
+checks how many images are generated and how many jobs fail
+"""
+
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import comfy_pipeline
+from comfy_pipeline import ComfyClient, run_pipeline
+from fake_comfyui import FakeComfyUI
+from generate_qwen import create_workflow
+
+# Nothing listens here: a backend that refuses connections
+REFUSING_URL = "http://127.0.0.1:9"
+
+
+def jobs(count: int) -> list:
+    return [(i + 1, create_workflow(f"check prompt {i + 1}", seed=i + 1)) for i in range(count)]
+
+
+def run(servers: list, job_count: int, extra_urls=(), **options) -> dict:
+    """run_pipeline on the servers into a scratch directory; returns counts and timings"""
+    urls = [server.url for server in servers] + list(extra_urls)
+    wall, cpu = time.time(), time.process_time()
+    with tempfile.TemporaryDirectory(prefix="focal-check-") as scratch:
+        with contextlib.redirect_stdout(io.StringIO()):
+            generated, errors = run_pipeline([ComfyClient(url) for url in urls], jobs(job_count),
+                                             Path(scratch), **options)
+        files = len(list(Path(scratch).glob("*.jpg")))
+    for server in servers:
+        server.stop()
+    return {"generated": len(generated), "errors": len(errors), "files": files,
+            "messages": [message for _, message in errors],
+            "prompts": [server.stats()["requests"].get("/prompt", 0) for server in servers],
+            "interrupts": [server.stats()["requests"].get("/interrupt", 0) for server in servers],
+            "seconds": time.time() - wall, "cpu": time.process_time() - cpu}
+
+
+def fake(latency: float = 0.01, **options) -> FakeComfyUI:
+    return FakeComfyUI(latency=latency, seed=1, **options).start()
+
+
+def check_backends_share_work(result):
+    assert result["generated"] == 20 and result["errors"] == 0 and result["files"] == 20, result
+    assert all(count > 0 for count in result["prompts"]), f"a backend got no prompts: {result['prompts']}"
+
+
+def check_dropped_prompt(result):
+    # Only the job whose /prompt was cut off is lost; the backend comes back after its cooldown
+    assert result["generated"] == 19 and result["errors"] == 1, result
+    assert result["prompts"] == [20], result
+
+
+def check_rejected_prompt(result):
+    # A 400 for one prompt fails that job without cooling the backend down
+    assert result["generated"] == 19 and result["errors"] == 1, result
+    assert result["seconds"] < comfy_pipeline.BACKEND_COOLDOWN, result
+
+
+def check_failing_backend(result):
+    # Every execution fails on one backend, so every job is retried on the other
+    assert result["generated"] == 10 and result["errors"] == 0, result
+
+
+def check_all_failing(result):
+    assert result["generated"] == 0 and result["errors"] == 6, result
+
+
+def check_refusing_backend(result):
+    # The untried backend refuses connections: jobs wait for its cooldown without spinning
+    assert result["generated"] == 0 and result["errors"] == 3, result
+    assert result["cpu"] < 1.0, f"busy loop: {result['cpu']:.2f}s CPU in {result['seconds']:.2f}s"
+
+
+def check_stalled_prompt(result):
+    # The stalled prompt is interrupted where it runs rather than left to render a second copy
+    assert result["generated"] == 4 and result["errors"] == 0, result
+    assert result["interrupts"][0] >= 1, result
+    assert result["seconds"] < 30, result
+
+
+def main():
+    print("=" * 60)
+    print("Focal Psychology Pipeline Checks")
+    print("=" * 60)
+    cooldown = comfy_pipeline.BACKEND_COOLDOWN
+    checks = [
+        ("three backends share the work", check_backends_share_work,
+         lambda: run([fake(), fake(), fake()], 20)),
+        ("dropped /prompt costs one image", check_dropped_prompt,
+         lambda: run([fake(prompt_faults={6: "drop"})], 20)),
+        ("rejected /prompt costs one image", check_rejected_prompt,
+         lambda: run([fake(prompt_faults={6: 400})], 20)),
+        ("failed executions move to another backend", check_failing_backend,
+         lambda: run([fake(failure_rate=1.0), fake()], 10)),
+        ("jobs failing everywhere are reported", check_all_failing,
+         lambda: run([fake(failure_rate=1.0), fake(failure_rate=1.0)], 6)),
+        ("cooling backend is waited for, not spun on", check_refusing_backend,
+         lambda: run([fake(failure_rate=1.0)], 3, extra_urls=[REFUSING_URL],
+                     use_websocket=False, poll_interval=0.1)),
+        ("stalled running prompt is interrupted", check_stalled_prompt,
+         lambda: run([fake(latency=60), fake()], 4, window=1, timeout=1)),
+    ]
+    failed = 0
+    for title, check, scenario in checks:
+        # Short cooldowns keep the checks fast; the rejected-prompt check needs the real one
+        comfy_pipeline.BACKEND_COOLDOWN = cooldown if check is check_rejected_prompt else 1
+        try:
+            check(scenario())
+            print(f"  PASS: {title}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL: {title}: {e}")
+    comfy_pipeline.BACKEND_COOLDOWN = cooldown
+    print("=" * 60)
+    print(f"{len(checks) - failed} of {len(checks)} checks passed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
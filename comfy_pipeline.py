@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+"""
+Pipelined ComfyUI generation for Focal Psychology images
+Keeps a window of workflows queued in ComfyUI and saves results as they finish
+"""
+
+import http.client
+import json
+import os
+import select
+import threading
+import time
+import urllib.error
+import urllib.parse
+import uuid
+from collections import deque
+from pathlib import Path
+
+from run_metrics import RunMetrics, execution_window, stage_times
+from workflow_templates import residency_key
+
+try:
+    import websocket  # websocket-client, optional: without it we poll /history
+except ImportError:
+    websocket = None
+
+# With a live websocket, /history is only swept after this many quiet seconds
+WS_SAFETY_POLL = 30
+# How often each backend's /queue depth is re-read for scheduling
+QUEUE_REFRESH = 10
+# A backend that refused a prompt is skipped for this many seconds
+BACKEND_COOLDOWN = 30
+# Rough cost of loading other weights, charged to a backend that last ran different models
+MODEL_SWITCH_SECONDS = 60
+# Socket timeout for every HTTP request, and the /view read size
+HTTP_TIMEOUT = 30
+DOWNLOAD_CHUNK = 256 * 1024
+# Requests that must not be sent twice only reuse connections idle for less
+# than this, well inside the keep-alive timeout of ComfyUI's server (75 s)
+POST_REUSE_IDLE = 15
+
+
+def connection_dropped(conn) -> bool:
+    """True if the server has closed an idle connection: its socket reads EOF"""
+    if conn.sock is None:
+        return True
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+    return bool(readable)
+
+
+class HttpSession:
+    """
+    Keep-alive HTTP/1.1 connections to one host.
+
+    Idle connections are pooled and reused across requests and threads. A
+    GET on a pooled connection the server has since closed is retried on a
+    fresh one. A POST is retried only if sending it failed: once it is fully
+    written the server may have acted on it, and a second /prompt would
+    queue the work twice. POSTs therefore skip connections idle for longer
+    than POST_REUSE_IDLE seconds, and any request skips connections the
+    server has visibly closed.
+    """
+
+    def __init__(self, url: str, timeout: float = HTTP_TIMEOUT, pool_size: int = 4):
+        parts = urllib.parse.urlsplit(url)
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                  else http.client.HTTPConnection)
+        self._host = parts.netloc
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = []  # [(connection, released at)]
+        self._lock = threading.Lock()
+
+    def _open(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        """Send a request and return (connection, response) with the body unread"""
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault('Content-Type', 'application/json')
+        while True:
+            with self._lock:
+                conn, released = self._idle.pop() if self._idle else (None, None)
+            if conn is not None and (connection_dropped(conn) or (
+                    method != 'GET' and time.time() - released > POST_REUSE_IDLE)):
+                conn.close()
+                continue
+            reused = conn is not None
+            if conn is None:
+                conn = self._connection_class(self._host, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+            except (ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused:
+                    continue  # stale keep-alive connection, the request never got out
+                raise
+            except Exception:
+                conn.close()
+                raise
+            try:
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and method == 'GET':
+                    continue  # stale keep-alive connection, try a fresh one
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.status >= 400:
+                detail = response.read()
+                self._release(conn, response)
+                raise urllib.error.HTTPError(path, response.status,
+                                             f"{response.reason}: {detail[:500]!r}",
+                                             response.headers, None)
+            return conn, response
+
+    def _release(self, conn, response) -> None:
+        if response.will_close:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def request(self, method: str, path: str, body: bytes = None) -> bytes:
+        conn, response = self._open(method, path, body)
+        try:
+            return response.read()
+        finally:
+            self._release(conn, response)
+
+    def download(self, path: str, dest: Path, chunk_size: int = DOWNLOAD_CHUNK) -> int:
+        """
+        Stream a response body to dest and return its size.
+
+        Data goes to a hidden .part file in the same directory and is renamed
+        over dest only when complete, so dest is never seen half-written.
+        """
+        part = dest.with_name(f".{dest.name}.part")
+        conn, response = self._open('GET', path)
+        size = 0
+        try:
+            with open(part, 'wb') as f:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(part, dest)
+        except BaseException:
+            conn.close()
+            part.unlink(missing_ok=True)
+            raise
+        self._release(conn, response)
+        return size
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+class ComfyClient:
+    """Minimal client for the ComfyUI HTTP API"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.client_id = str(uuid.uuid4())
+        self.http = HttpSession(self.url)
+
+    def _get_json(self, path: str):
+        return json.loads(self.http.request('GET', path))
+
+    def _post_json(self, path: str, payload: dict) -> bytes:
+        return self.http.request('POST', path, json.dumps(payload).encode('utf-8'))
+
+    def queue_prompt(self, workflow: dict) -> str:
+        """Queue a workflow graph and return the prompt_id"""
+        response = self._post_json("/prompt", {"prompt": workflow, "client_id": self.client_id})
+        return json.loads(response)['prompt_id']
+
+    def get_history(self, prompt_id: str) -> dict:
+        """Get the history for a prompt"""
+        return self._get_json(f"/history/{prompt_id}")
+
+    def download_image(self, filename: str, subfolder: str, folder_type: str, dest: Path) -> int:
+        """Stream a generated image to dest; returns the number of bytes"""
+        query = urllib.parse.urlencode({"filename": filename, "subfolder": subfolder,
+                                        "type": folder_type})
+        return self.http.download(f"/view?{query}", dest)
+
+    def get_queue(self) -> dict:
+        """Get the running and pending queue"""
+        return self._get_json("/queue")
+
+    def queued_prompt_ids(self) -> set:
+        """prompt_ids ComfyUI is currently running or has pending"""
+        queue = self.get_queue()
+        return {item[1] for item in queue.get('queue_running', []) + queue.get('queue_pending', [])}
+
+    def cancel(self, prompt_id: str) -> None:
+        """Interrupt a prompt if it is running, otherwise drop it from the pending queue"""
+        running = {item[1] for item in self.get_queue().get('queue_running', [])}
+        if prompt_id in running:
+            self._post_json("/interrupt", {"prompt_id": prompt_id})
+        else:
+            self._post_json("/queue", {"delete": [prompt_id]})
+
+    def system_stats(self) -> dict:
+        """Get ComfyUI system information"""
+        return self._get_json("/system_stats")
+
+
+def connect_backends(urls) -> list:
+    """Clients for the reachable ComfyUI instances among urls, with their versions printed"""
+    clients = []
+    for url in urls:
+        client = ComfyClient(url)
+        try:
+            stats = client.system_stats()
+        except Exception as e:
+            print(f"ERROR: Cannot connect to ComfyUI at {url}")
+            print(f"  {e}")
+            continue
+        print(f"ComfyUI {url}: {stats['system']['comfyui_version']}, "
+              f"PyTorch {stats['system']['pytorch_version']}")
+        clients.append(client)
+    return clients
+
+
+class CompletionListener:
+    """
+    Follows ComfyUI's /ws event stream for prompts queued by one client.
+
+    A single socket serves every in-flight prompt: `executed` events collect
+    node outputs, and `execution_success`/`executing` with node None (or an
+    error event) mark the prompt as finished and wake whoever is waiting.
+    """
+
+    def __init__(self, client: ComfyClient, cond: threading.Condition = None):
+        self.client = client
+        self.connected = False
+        self._ws = None
+        self._cond = cond or threading.Condition()  # may be shared by several listeners
+        self._outputs = {}  # prompt_id -> {node_id: output}
+        self._done = {}  # prompt_id -> history-shaped result
+        self._started = {}  # prompt_id -> execution_start arrival, ms
+        # Finished or handed out already: ComfyUI reports completion twice
+        # (execution_success, then executing with node None), and the second
+        # must not bring a taken prompt back
+        self._closed = set()
+        self.on_start = None  # called with the prompt_id when execution starts
+
+    def start(self, timeout: float = 10) -> bool:
+        """Open the socket; returns False if websockets are unavailable"""
+        if websocket is None:
+            return False
+        url = self.client.url.replace('http', 'ws', 1) + f"/ws?clientId={self.client.client_id}"
+        try:
+            self._ws = websocket.create_connection(url, timeout=timeout)
+        except Exception as e:
+            print(f"  WARNING: websocket unavailable ({e}), polling history instead")
+            return False
+        self._ws.settimeout(None)
+        self.connected = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return True
+
+    def close(self):
+        if self._ws is not None:
+            # The reader thread owns recv(), so skip the close handshake
+            self._ws.abort()
+            self._ws.shutdown()
+
+    def _run(self):
+        try:
+            while True:
+                message = self._ws.recv()
+                if isinstance(message, str):  # binary frames are previews
+                    self._handle(json.loads(message))
+        except Exception:
+            pass
+        with self._cond:
+            self.connected = False
+            self._cond.notify_all()
+
+    def _handle(self, message: dict):
+        kind = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if prompt_id is None:
+            return
+        if kind == 'execution_start':
+            self._started[prompt_id] = int(time.time() * 1000)
+            if self.on_start is not None:
+                self.on_start(prompt_id)
+        elif kind == 'executed' and data.get('output'):
+            self._outputs.setdefault(prompt_id, {})[data['node']] = data['output']
+        elif kind == 'execution_success' or (kind == 'executing' and data.get('node') is None):
+            self._finish(prompt_id, 'success', ['execution_success', {
+                'prompt_id': prompt_id, 'timestamp': int(time.time() * 1000)}])
+        elif kind in ('execution_error', 'execution_interrupted'):
+            self._finish(prompt_id, 'error', [kind, data.get('exception_message', kind)])
+
+    def _finish(self, prompt_id: str, status_str: str, message: list):
+        """Store a history-shaped result, its messages stamped with when the events arrived"""
+        with self._cond:
+            if prompt_id in self._closed:
+                return
+            self._closed.add(prompt_id)
+            outputs = self._outputs.pop(prompt_id, {})
+            messages = [message]
+            started = self._started.pop(prompt_id, None)
+            if started is not None:
+                messages.insert(0, ['execution_start', {'prompt_id': prompt_id, 'timestamp': started}])
+            self._done[prompt_id] = {'outputs': outputs, 'status': {
+                'status_str': status_str, 'completed': status_str == 'success', 'messages': messages}}
+            self._cond.notify_all()
+
+    def has_finished(self, prompt_ids) -> bool:
+        return any(p in self._done for p in prompt_ids)
+
+    def take(self, prompt_ids) -> dict:
+        """Remove and return the finished results among prompt_ids"""
+        with self._cond:
+            return {p: self._done.pop(p) for p in list(prompt_ids) if p in self._done}
+
+    def forget(self, prompt_ids) -> None:
+        """Drop prompts collected some other way (a /history sweep) and ignore their late events"""
+        with self._cond:
+            for prompt_id in prompt_ids:
+                self._closed.add(prompt_id)
+                self._done.pop(prompt_id, None)
+                self._outputs.pop(prompt_id, None)
+                self._started.pop(prompt_id, None)
+
+    def wait(self, prompt_ids, timeout: float) -> dict:
+        """Block until one of prompt_ids finishes (or timeout); return the finished ones"""
+        prompt_ids = list(prompt_ids)
+        with self._cond:
+            self._cond.wait_for(
+                lambda: not self.connected or self.has_finished(prompt_ids), timeout)
+            return self.take(prompt_ids)
+
+
+def poll_history(client: ComfyClient, prompt_ids) -> dict:
+    """Check /history for each prompt; return the finished ones"""
+    finished = {}
+    for prompt_id in prompt_ids:
+        try:
+            history = client.get_history(prompt_id)
+        except Exception as e:
+            print(f"  WARNING: history request failed for {prompt_id}: {e}")
+            continue
+        if prompt_id in history:
+            finished[prompt_id] = history[prompt_id]
+    return finished
+
+
+def output_filename(name) -> str:
+    """Output file name for a CHAPTER_PROMPTS key"""
+    if isinstance(name, int):
+        return f"chapter-{name:02d}.jpg"
+    return f"{name}.jpg"
+
+
+def output_images(result: dict) -> list:
+    """Image descriptors from a history entry, in node order"""
+    status = result.get('status', {})
+    if status.get('status_str') == 'error':
+        raise RuntimeError(f"ComfyUI execution failed: {status.get('messages', [])[-1:]}")
+    images = []
+    for node_id, node_output in result.get('outputs', {}).items():
+        images.extend(node_output.get('images', []))
+    return images
+
+
+def variant_filename(name, index: int) -> str:
+    """File name for candidate `index` (1-based) of a variants sweep"""
+    stem = output_filename(name)[:-len('.jpg')]
+    return f"{stem}.v{index}.jpg"
+
+
+def save_result(client: ComfyClient, name, prompt_id: str, result: dict, output_dir: Path,
+                variants: int = 1) -> list:
+    """
+    Download the outputs of a finished prompt into output_dir.
+
+    Normally only the first image is kept, as chapter-XX.jpg; in a variants
+    sweep each batch image i becomes chapter-XX.v<i>.jpg. Returns the paths.
+    """
+    images = output_images(result)
+    if not images and result.get('status', {}).get('status_str') == 'success':
+        # Fully cached prompts emit no `executed` events; history has the outputs
+        images = output_images(client.get_history(prompt_id).get(prompt_id, {}))
+    if not images:
+        raise ValueError(f"No images in output for {name}")
+    if variants > 1:
+        targets = [variant_filename(name, i + 1) for i in range(min(variants, len(images)))]
+    else:
+        targets = [output_filename(name)]
+    paths = []
+    for image_info, filename in zip(images, targets):
+        output_path = output_dir / filename
+        client.download_image(
+            image_info['filename'],
+            image_info.get('subfolder', ''),
+            image_info.get('type', 'output'),
+            output_path
+        )
+        paths.append(str(output_path))
+    return paths
+
+
+class Job:
+    """A workflow to render, with the backends it has already failed on"""
+
+    def __init__(self, name, workflow: dict):
+        self.name = name
+        self.workflow = workflow
+        self.tried = set()
+        self.created = self.ready = time.time()  # ready: (re)entered the pending queue
+        self.submitted = None
+        self.attempts = 0
+        self.resident = residency_key(workflow)
+
+
+def group_by_residency(jobs) -> list:
+    """
+    Jobs reordered so those needing the same weights and resolution are
+    adjacent, groups in order of first appearance and jobs in order within.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.resident, []).append(job)
+    return [job for group in groups.values() for job in group]
+
+
+class Backend:
+    """
+    Scheduler view of one ComfyUI instance.
+
+    Tracks our in-flight prompts, the depth of its /queue that is not ours
+    and a moving average of seconds per finished image, so jobs go to the
+    backend expected to start them soonest. `resident` is the residency key
+    of the last job sent there, i.e. the weights it will have loaded.
+    """
+
+    def __init__(self, client: ComfyClient):
+        self.client = client
+        self.listener = None
+        self.in_flight = {}  # prompt_id -> Job, in submission order
+        self.seconds_per_image = None
+        self.external_depth = 0
+        self.queue_checked = 0.0
+        self.down_until = 0.0
+        self.last_progress = time.time()
+        self.last_sweep = time.time()
+        self.completed = 0
+        self.resident = None
+
+    @property
+    def url(self) -> str:
+        return self.client.url
+
+    @property
+    def streaming(self) -> bool:
+        return self.listener is not None and self.listener.connected
+
+    def available(self, window: int) -> bool:
+        return len(self.in_flight) < window and time.time() >= self.down_until
+
+    def refresh_queue(self) -> None:
+        if time.time() - self.queue_checked < QUEUE_REFRESH:
+            return
+        self.queue_checked = time.time()
+        try:
+            queued = self.client.queued_prompt_ids()
+        except Exception:
+            return
+        self.external_depth = len(queued - set(self.in_flight))
+
+    def expected_wait(self, default_seconds: float, job: Job = None) -> float:
+        backlog = self.external_depth + len(self.in_flight) + 1
+        wait = backlog * (self.seconds_per_image or default_seconds)
+        if job is not None and self.resident not in (None, job.resident):
+            wait += MODEL_SWITCH_SECONDS
+        return wait
+
+    def submitted(self) -> None:
+        if not self.in_flight:
+            self.last_progress = time.time()
+
+    def finished_one(self) -> None:
+        now = time.time()
+        sample = now - self.last_progress
+        if self.seconds_per_image is None:
+            self.seconds_per_image = sample
+        else:
+            self.seconds_per_image = 0.7 * self.seconds_per_image + 0.3 * sample
+        self.last_progress = self.last_sweep = now
+        self.completed += 1
+
+
+def pick_backend(pool: list, job: Job, window: int):
+    """
+    Backend expected to finish this job soonest, or None if that backend is full.
+
+    Holding a job back for a busy fast backend beats handing it to an idle
+    slow one that would finish it later. A backend that would have to swap
+    models for the job counts MODEL_SWITCH_SECONDS extra.
+    """
+    now = time.time()
+    candidates = [b for b in pool if b.url not in job.tried and now >= b.down_until]
+    if not candidates:
+        return None
+    known = [b.seconds_per_image for b in pool if b.seconds_per_image]
+    default_seconds = sum(known) / len(known) if known else 1.0
+    for backend in candidates:
+        backend.refresh_queue()
+    best = min(candidates, key=lambda b: b.expected_wait(default_seconds, job))
+    return best if best.available(window) else None
+
+
+def run_pipeline(backends, jobs, output_dir: Path, window: int = 4,
+                 timeout: int = 120, poll_interval: float = 1.0, use_websocket: bool = True,
+                 on_saved=None, journal=None, attached=None, variants: int = 1, metrics=None):
+    """
+    Generate images for (name, workflow) jobs with up to `window` prompts in
+    flight on each backend.
+
+    `backends` is a ComfyClient or a list of them. Each job goes to the free
+    backend with the shortest expected wait (its /queue depth times its recent
+    seconds per image); a job that fails or stalls is retried on a backend it
+    has not failed on yet. Jobs are queued grouped by the models and
+    resolution they need, so ComfyUI loads each set of weights once per run.
+    New prompts are queued as soon as a slot frees up, so ComfyUI always has
+    the next job waiting while finished images are downloaded. Completion is
+    taken from the /ws event stream when possible and from polling /history
+    every `poll_interval` seconds otherwise.
+    `timeout` is a stall timeout per image: if a backend finishes nothing for
+    that long (times the batch size in a variants sweep, as a batch finishes
+    all at once), its oldest in-flight prompt is given up on.
+    `on_saved(name, path)` is called after each image is written. With
+    `variants` > 1 every job is a batch and all of its images are kept.
+
+    `journal` (a generation_cache.JobJournal) records every state change, and
+    `attached` maps backend URL -> {prompt_id: (name, workflow)} for prompts
+    already known to ComfyUI, so an interrupted run can pick them up instead
+    of queueing them again.
+
+    `metrics` (a run_metrics.RunMetrics) receives every queueing, retry,
+    error and saved image with its stage timings; the caller keeps it to
+    write reports. Without one, the stage summary is only printed.
+
+    Returns (generated, errors) as lists of (name, path) and (name, message).
+    """
+    clients = backends if isinstance(backends, (list, tuple)) else [backends]
+    pool = [Backend(client) for client in clients]
+    pending = deque(group_by_residency(Job(name, workflow) for name, workflow in jobs))
+    generated = []
+    errors = []
+    stall_timeout = timeout * max(1, variants)
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = RunMetrics()
+
+    for backend in pool:
+        for prompt_id, (name, workflow) in (attached or {}).get(backend.url, {}).items():
+            backend.in_flight[prompt_id] = Job(name, workflow)
+            backend.resident = backend.in_flight[prompt_id].resident
+        if backend.in_flight:
+            backend.last_sweep = 0  # reattached prompts may have finished while we were away
+
+    events = threading.Condition()
+    for backend in pool:
+        if not use_websocket:
+            break
+        listener = CompletionListener(backend.client, events)
+        if journal is not None:
+            listener.on_start = lambda prompt_id: journal.update(prompt_id, 'running')
+        if listener.start():
+            backend.listener = listener
+    streaming = sum(1 for b in pool if b.listener)
+    groups = len({job.resident for job in pending})
+    if groups > 1:
+        print(f"Model groups: {groups}, queued group by group")
+    print(f"Completion events: {streaming}/{len(pool)} backends on websocket, rest polling /history")
+
+    def retry_or_fail(job: Job, backend: Backend, prompt_id, message: str):
+        job.tried.add(backend.url)
+        if journal is not None and prompt_id is not None:
+            journal.update(prompt_id, 'failed')
+        if any(b.url not in job.tried for b in pool):
+            print(f"  RETRY: {job.name} on another backend ({message})")
+            metrics.retry(job.name, backend.url, message)
+            job.ready = time.time()
+            pending.appendleft(job)
+        else:
+            print(f"  ERROR: {job.name}: {message}")
+            metrics.failed(job.name, backend.url, message)
+            errors.append((job.name, message))
+
+    try:
+        while pending or any(b.in_flight for b in pool):
+            metrics.set_load(len(pending), {b.url: len(b.in_flight) for b in pool})
+            # Submit: fill free slots, best backend first
+            for job in list(pending):
+                if not any(b.available(window) for b in pool):
+                    break
+                backend = pick_backend(pool, job, window)
+                if backend is None:
+                    continue  # its remaining backends are busy; let later jobs go first
+                pending.remove(job)
+                job.submitted = time.time()
+                job.attempts += 1
+                try:
+                    prompt_id = backend.client.queue_prompt(job.workflow)
+                except Exception as e:
+                    # A 4xx is about this prompt, not the backend
+                    if not (isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500):
+                        backend.down_until = time.time() + BACKEND_COOLDOWN
+                    retry_or_fail(job, backend, None, f"queueing on {backend.url} failed: {e}")
+                    continue
+                backend.submitted()
+                backend.in_flight[prompt_id] = job
+                backend.resident = job.resident
+                if journal is not None:
+                    journal.queued(job.name, prompt_id, job.workflow, backend.client)
+                where = f" @ {backend.url}" if len(pool) > 1 else ""
+                print(f"Queued: {job.name} -> {prompt_id}{where}")
+                metrics.queued(job.name, prompt_id, backend.url, job.attempts)
+
+            busy = [b for b in pool if b.in_flight]
+            if not busy:
+                # Every pending job still has an untried backend, so one must be
+                # cooling down: wait for it rather than spin
+                now = time.time()
+                cooling = [b.down_until for b in pool if b.down_until > now]
+                time.sleep(min(cooling) - now if cooling else poll_interval)
+                continue
+
+            # Collect: websocket results, safety sweeps and plain polling
+            finished = []  # (backend, prompt_id, result, collected)
+            for backend in busy:
+                if not backend.streaming or time.time() - backend.last_sweep > WS_SAFETY_POLL:
+                    results = poll_history(backend.client, backend.in_flight)
+                    backend.last_sweep = time.time()
+                    if backend.listener is not None:
+                        backend.listener.forget(results)
+                else:
+                    results = backend.listener.take(backend.in_flight)
+                collected = time.time()
+                finished.extend((backend, p, r, collected) for p, r in results.items())
+            if not finished:
+                streams = [b for b in busy if b.streaming]
+                if streams:
+                    wait = poll_interval if len(streams) < len(busy) else min(timeout, 5)
+                    with events:
+                        events.wait_for(lambda: any(
+                            not b.streaming or b.listener.has_finished(b.in_flight)
+                            for b in streams), wait)
+                else:
+                    time.sleep(poll_interval)
+
+            for backend, prompt_id, result, collected in finished:
+                job = backend.in_flight.pop(prompt_id)
+                try:
+                    paths = save_result(backend.client, job.name, prompt_id, result,
+                                        output_dir, variants)
+                except Exception as e:
+                    retry_or_fail(job, backend, prompt_id, str(e))
+                    continue
+                saved = time.time()
+                backend.finished_one()
+                if journal is not None:
+                    journal.update(prompt_id, 'downloaded')
+                start, end = execution_window(result)
+                metrics.image(job.name, prompt_id, backend.url, job.attempts,
+                              stage_times(job.ready, job.submitted, start, end, collected, saved),
+                              saved - job.created, [Path(path).name for path in paths],
+                              sum(os.path.getsize(path) for path in paths))
+                for path in paths:
+                    print(f"  Saved: {path}")
+                    generated.append((job.name, path))
+                    if on_saved is not None:
+                        on_saved(job.name, path)
+
+            # Stalls: give up on the oldest prompt of a backend that went quiet
+            for backend in busy:
+                if backend.in_flight and time.time() - backend.last_progress > stall_timeout:
+                    prompt_id = next(iter(backend.in_flight))
+                    job = backend.in_flight.pop(prompt_id)
+                    # If the cancel does not get through the prompt may still
+                    # finish on this backend, and the retry renders it twice
+                    try:
+                        backend.client.cancel(prompt_id)
+                    except Exception:
+                        pass
+                    backend.last_progress = time.time()
+                    retry_or_fail(job, backend, prompt_id,
+                                  f"Prompt {prompt_id} did not complete in {stall_timeout} seconds")
+    finally:
+        for backend in pool:
+            if backend.listener is not None:
+                backend.listener.close()
+
+    if len(pool) > 1:
+        for backend in pool:
+            pace = f"{backend.seconds_per_image:.1f}s/image" if backend.seconds_per_image else "-"
+            print(f"Backend {backend.url}: {backend.completed} images, {pace}")
+    metrics.print_summary()
+    if own_metrics:
+        metrics.close()
+    return generated, errors
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Stand-in ComfyUI server for benchmarking the Focal Psychology generators
+Implements the parts of the ComfyUI API the pipeline uses, with configurable
+execution latency, model load time, failure rate and image size, and no GPU
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from workflow_templates import MODEL_INPUTS
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def workflow_models(workflow: dict) -> tuple:
+    """The model files a workflow loads, in a stable order"""
+    return tuple(sorted({node.get("inputs", {})[name] for node in workflow.values()
+                         for name in MODEL_INPUTS if name in node.get("inputs", {})}))
+
+
+def workflow_batch(workflow: dict) -> int:
+    sizes = [node["inputs"]["batch_size"] for node in workflow.values()
+             if isinstance(node.get("inputs", {}).get("batch_size"), int)]
+    return max(sizes, default=1)
+
+
+def output_node(workflow: dict) -> str:
+    """Id of the SaveImage node, where ComfyUI reports the images"""
+    for node_id, node in workflow.items():
+        if node.get("class_type") == "SaveImage":
+            return node_id
+    return next(iter(workflow), "9")
+
+
+def image_bytes(size: int) -> bytes:
+    """Deterministic filler of `size` bytes framed as a JPEG"""
+    body = hashlib.shake_256(b"fake-comfyui").digest(max(size - 4, 0))
+    return b"\xff\xd8" + body + b"\xff\xd9"
+
+
+class FakeComfyUI:
+    """
+    ComfyUI look-alike: /prompt, /history, /view, /queue, /system_stats and /ws.
+
+    Prompts run one at a time, like on a single GPU. Each takes `latency`
+    seconds per image (plus up to `jitter` at random), and `load_latency`
+    more when its models differ from the previous prompt's. A `failure_rate`
+    share of prompts ends in an execution error. `prompt_faults` maps the
+    number of a POST /prompt (1-based) to what happens to it instead:
+    "drop" closes the connection unanswered, an int is sent as the HTTP
+    status. Request counts and per-prompt timings are kept for the benchmark.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.5,
+                 jitter: float = 0.0, load_latency: float = 0.0, failure_rate: float = 0.0,
+                 image_size: int = 200 * 1024, seed: int = None, prompt_faults: dict = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.load_latency = load_latency
+        self.failure_rate = failure_rate
+        self.prompt_faults = dict(prompt_faults or {})
+        self.image = image_bytes(image_size)
+        self.random = random.Random(seed)
+        self.lock = threading.Condition()
+        self.pending = []  # [(number, prompt_id, workflow, client_id)]
+        self.running = None
+        self.interrupted = False  # set by POST /interrupt for the running prompt
+        self.history = {}
+        self.prompts = {}  # prompt_id -> {"queued", "started", "finished", "last_view", "client_id"}
+        self.requests = {}  # endpoint -> count
+        self.loaded_models = None
+        self.model_loads = 0
+        self.sockets = {}  # client_id -> [handler]
+        self.number = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._stopped = False
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeComfyUI":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._execute, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        with self.lock:
+            self._stopped = True
+            self.lock.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        """Request counts, model loads and per-prompt timings so far"""
+        with self.lock:
+            return {"requests": dict(self.requests), "model_loads": self.model_loads,
+                    "prompts": {p: dict(t) for p, t in self.prompts.items()}}
+
+    # Execution
+
+    def _execute(self) -> None:
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.pending or self._stopped)
+                if self._stopped:
+                    return
+                number, prompt_id, workflow, client_id = self.pending.pop(0)
+                self.running = (number, prompt_id, workflow, client_id)
+                self.prompts[prompt_id]["started"] = time.time()
+            self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+
+            seconds = self.latency * workflow_batch(workflow) + self.random.uniform(0, self.jitter)
+            models = workflow_models(workflow)
+            if models != self.loaded_models:
+                seconds += self.load_latency
+                self.loaded_models = models
+                self.model_loads += 1
+            # POST /interrupt cuts the execution short
+            with self.lock:
+                interrupted = self.lock.wait_for(lambda: self.interrupted or self._stopped, seconds)
+                interrupted = bool(interrupted) and self.interrupted
+                self.interrupted = False
+
+            node = output_node(workflow)
+            failed = interrupted or self.random.random() < self.failure_rate
+            # Status messages carry millisecond timestamps, as in ComfyUI's history
+            messages = [["execution_start", {"prompt_id": prompt_id,
+                                             "timestamp": int(self.prompts[prompt_id]["started"] * 1000)}]]
+            if interrupted:
+                outputs = {}
+                messages.append(["execution_interrupted", {"prompt_id": prompt_id, "node_id": node,
+                                                           "timestamp": int(time.time() * 1000)}])
+                status = {"status_str": "error", "completed": False, "messages": messages}
+            elif failed:
+                outputs = {}
+                messages.append(["execution_error", {"prompt_id": prompt_id, "node_id": node,
+                                                     "exception_message": "fake failure",
+                                                     "timestamp": int(time.time() * 1000)}])
+                status = {"status_str": "error", "completed": False, "messages": messages}
+            else:
+                images = [{"filename": f"{prompt_id}_{i:05d}_.png", "subfolder": "", "type": "output"}
+                          for i in range(workflow_batch(workflow))]
+                outputs = {node: {"images": images}}
+                messages.append(["execution_success", {"prompt_id": prompt_id,
+                                                       "timestamp": int(time.time() * 1000)}])
+                status = {"status_str": "success", "completed": True, "messages": messages}
+            # History first, as ComfyUI does: a client may fetch it on the first event
+            with self.lock:
+                self.history[prompt_id] = {"prompt": [number, prompt_id, workflow, {}, [node]],
+                                           "outputs": outputs, "status": status}
+                self.prompts[prompt_id]["finished"] = time.time()
+                self.prompts[prompt_id]["failed"] = failed
+                self.running = None
+            if interrupted:
+                self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node})
+            elif failed:
+                self._send(client_id, "execution_error", {"prompt_id": prompt_id, "node_id": node,
+                                                          "exception_message": "fake failure"})
+            else:
+                self._send(client_id, "executing", {"node": node, "prompt_id": prompt_id})
+                self._send(client_id, "executed", {"node": node, "output": outputs[node],
+                                                   "prompt_id": prompt_id})
+                self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+                self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    # Websocket
+
+    def _send(self, client_id: str, kind: str, data: dict) -> None:
+        payload = json.dumps({"type": kind, "data": data}).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(payload))
+        with self.lock:
+            handlers = list(self.sockets.get(client_id, []))
+        for handler in handlers:
+            try:
+                with handler.send_lock:
+                    handler.wfile.write(header + payload)
+                    handler.wfile.flush()
+            except OSError:
+                with self.lock:
+                    if handler in self.sockets.get(client_id, []):
+                        self.sockets[client_id].remove(handler)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _count(self, endpoint: str) -> None:
+                with fake.lock:
+                    fake.requests[endpoint] = fake.requests.get(endpoint, 0) + 1
+
+            def _reply(self, body: bytes, content_type: str = "application/json", status: int = 200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, data, status: int = 200):
+                self._reply(json.dumps(data).encode("utf-8"), status=status)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_POST(self):
+                path = urllib.parse.urlsplit(self.path).path
+                if path == "/prompt":
+                    self._count("/prompt")
+                    body = self._body()
+                    with fake.lock:
+                        fault = fake.prompt_faults.get(fake.requests["/prompt"])
+                    if fault == "drop":
+                        self.close_connection = True
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        return
+                    if fault is not None:
+                        self._json({"error": {"type": "fault", "message": "injected"}, "node_errors": {}},
+                                   status=fault)
+                        return
+                    workflow = body.get("prompt")
+                    if not isinstance(workflow, dict) or not workflow:
+                        self._json({"error": {"type": "invalid_prompt", "message": "no prompt"},
+                                    "node_errors": {}}, status=400)
+                        return
+                    prompt_id = str(uuid.uuid4())
+                    with fake.lock:
+                        fake.number += 1
+                        number = fake.number
+                        fake.pending.append((number, prompt_id, workflow, body.get("client_id")))
+                        fake.prompts[prompt_id] = {"queued": time.time(), "client_id": body.get("client_id")}
+                        fake.lock.notify_all()
+                    self._json({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+                elif path == "/queue":
+                    self._count("/queue")
+                    body = self._body()
+                    with fake.lock:
+                        if body.get("clear"):
+                            fake.pending.clear()
+                        delete = set(body.get("delete", []))
+                        fake.pending = [item for item in fake.pending if item[1] not in delete]
+                    self._json({})
+                elif path == "/interrupt":
+                    self._count("/interrupt")
+                    body = self._body()
+                    with fake.lock:
+                        # Without a prompt_id ComfyUI interrupts whatever is running
+                        if fake.running and body.get("prompt_id") in (None, fake.running[1]):
+                            fake.interrupted = True
+                            fake.lock.notify_all()
+                    self._json({})
+                else:
+                    self._count("other")
+                    self._json({"error": "not found"}, status=404)
+
+            def do_GET(self):
+                parts = urllib.parse.urlsplit(self.path)
+                path = parts.path
+                if path.startswith("/history"):
+                    self._count("/history")
+                    prompt_id = path[len("/history/"):] if path.startswith("/history/") else None
+                    with fake.lock:
+                        if prompt_id is None:
+                            self._json(fake.history)
+                        else:
+                            entry = fake.history.get(prompt_id)
+                            self._json({prompt_id: entry} if entry else {})
+                elif path == "/view":
+                    self._count("/view")
+                    filename = urllib.parse.parse_qs(parts.query).get("filename", [""])[0]
+                    prompt_id = filename.split("_")[0]
+                    with fake.lock:
+                        known = prompt_id in fake.history and fake.history[prompt_id]["outputs"]
+                    if not known:
+                        self._json({"error": "not found"}, status=404)
+                        return
+                    self._reply(fake.image, "image/png")
+                    with fake.lock:
+                        fake.prompts[prompt_id]["last_view"] = time.time()
+                elif path == "/queue":
+                    self._count("/queue")
+                    with fake.lock:
+                        running = [list(fake.running[:3]) + [{}, []]] if fake.running else []
+                        pending = [[n, p, w, {}, []] for n, p, w, _ in fake.pending]
+                    self._json({"queue_running": running, "queue_pending": pending})
+                elif path == "/system_stats":
+                    self._count("/system_stats")
+                    self._json({"system": {"os": "fake", "comfyui_version": "fake-0.1",
+                                           "python_version": "", "pytorch_version": "none",
+                                           "embedded_python": False},
+                                "devices": [{"name": "fake", "type": "cpu", "index": 0,
+                                             "vram_total": 0, "vram_free": 0}]})
+                elif path == "/ws":
+                    self._count("/ws")
+                    self._websocket(urllib.parse.parse_qs(parts.query).get("clientId", [None])[0])
+                else:
+                    self._count("other")
+                    self._json({"error": "not found"}, status=404)
+
+            def _websocket(self, client_id: str):
+                key = self.headers.get("Sec-WebSocket-Key", "")
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101, "Switching Protocols")
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+                self.send_lock = threading.Lock()
+                client_id = client_id or str(uuid.uuid4())
+                with fake.lock:
+                    fake.sockets.setdefault(client_id, []).append(self)
+                fake._send(client_id, "status", {"status": {"exec_info": {"queue_remaining": 0}},
+                                                 "sid": client_id})
+                try:
+                    # Only closing matters; the client sends nothing else we act on
+                    while self.rfile.read(1):
+                        pass
+                except OSError:
+                    pass
+                with fake.lock:
+                    if self in fake.sockets.get(client_id, []):
+                        fake.sockets[client_id].remove(self)
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in ComfyUI server for benchmarks")
+    parser.add_argument("--port", type=int, default=8190, help="port to listen on (default: 8190)")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds of execution per image")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many random extra seconds")
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="extra seconds when a prompt needs other models than the previous one")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of prompts that fail (0-1)")
+    parser.add_argument("--image-kb", type=int, default=200, help="size of every returned image in KB")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for jitter and failures")
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(port=args.port, latency=args.latency, jitter=args.jitter,
+                       load_latency=args.load_latency, failure_rate=args.failure_rate,
+                       image_size=args.image_kb * 1024, seed=args.seed).start()
+    print(f"Fake ComfyUI on {fake.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
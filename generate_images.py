@@ -4,17 +4,22 @@ Image Generator for Focal Psychology Book
 Uses ComfyUI API with Qwen workflow to generate chapter illustrations
 """
 
-import json
-import requests
+import argparse
 import time
-import os
-import urllib.request
-import uuid
 from pathlib import Path
 
+from comfy_pipeline import connect_backends, run_pipeline
+from generation_cache import (GenerationCache, JobJournal, parse_selection, plan_jobs,
+                              promote_variant, reattach_jobs)
+from run_metrics import RunMetrics
+from workflow_templates import load_template
+
 COMFYUI_URL = "http://127.0.0.1:8190"
+# Bump when a change outside create_workflow should invalidate cached images
+SCRIPT_VERSION = "1"
+# Graph in workflows/; editing it changes the cache key of every image it renders
+WORKFLOW = load_template("qwen-image-subgraph.v1")
 OUTPUT_DIR = Path(__file__).parent / "images"
-OUTPUT_DIR.mkdir(exist_ok=True)
 
 # Chapter prompts - artistic, metaphorical images for each chapter
 CHAPTER_PROMPTS = {
@@ -84,138 +89,80 @@ CHAPTER_PROMPTS = {
     "topology": "five concentric rings with golden center, consciousness topology diagram, ethereal glowing circles, cosmic background"
 }
 
-# Workflow template based on the Qwen workflow
-def create_workflow(prompt: str, seed: int = None) -> dict:
+def create_workflow(prompt: str, seed: int = None, batch_size: int = 1) -> dict:
+    """ComfyUI workflow for one prompt, from the qwen-image-subgraph.v1 template"""
     if seed is None:
         seed = int(time.time() * 1000) % 2147483647
-
-    return {
-        "prompt": {
-            "60": {
-                "inputs": {
-                    "images": ["75", 0],
-                    "filename_prefix": "focal_psychology"
-                },
-                "class_type": "SaveImage"
-            },
-            "75": {
-                "inputs": {
-                    "unet_name": "qwen_image_2512_fp8_e4m3fn.safetensors",
-                    "clip_name": "qwen_2.5_vl_7b_fp8_scaled.safetensors",
-                    "lora_name": "Qwen-Image-2512-Lightning-4steps-V1.0-bf16.safetensors",
-                    "width": 1328,
-                    "height": 1328,
-                    "batch_size": 1,
-                    "seed": seed,
-                    "steps": 4,
-                    "text": prompt
-                },
-                "class_type": "2c61139d-9c34-4c7e-a083-7a67cc4770ad"
-            }
-        }
-    }
-
-def queue_prompt(prompt: dict) -> str:
-    """Queue a prompt and return the prompt_id"""
-    data = json.dumps(prompt).encode('utf-8')
-    req = urllib.request.Request(f"{COMFYUI_URL}/prompt", data=data)
-    req.add_header('Content-Type', 'application/json')
-
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read())
-        return result['prompt_id']
-
-def get_history(prompt_id: str) -> dict:
-    """Get the history for a prompt"""
-    with urllib.request.urlopen(f"{COMFYUI_URL}/history/{prompt_id}") as response:
-        return json.loads(response.read())
-
-def get_image(filename: str, subfolder: str, folder_type: str) -> bytes:
-    """Download generated image"""
-    url = f"{COMFYUI_URL}/view?filename={filename}&subfolder={subfolder}&type={folder_type}"
-    with urllib.request.urlopen(url) as response:
-        return response.read()
-
-def wait_for_completion(prompt_id: str, timeout: int = 120) -> dict:
-    """Wait for prompt to complete and return outputs"""
-    start = time.time()
-    while time.time() - start < timeout:
-        history = get_history(prompt_id)
-        if prompt_id in history:
-            return history[prompt_id]
-        time.sleep(2)
-    raise TimeoutError(f"Prompt {prompt_id} did not complete in {timeout} seconds")
-
-def generate_image(name: str, prompt: str) -> str:
-    """Generate a single image and save it"""
-    print(f"Generating: {name}")
-    print(f"  Prompt: {prompt[:60]}...")
-
-    workflow = create_workflow(prompt)
-    prompt_id = queue_prompt(workflow)
-    print(f"  Queued: {prompt_id}")
-
-    result = wait_for_completion(prompt_id)
-
-    # Get the output image
-    outputs = result.get('outputs', {})
-    for node_id, node_output in outputs.items():
-        if 'images' in node_output:
-            for image_info in node_output['images']:
-                image_data = get_image(
-                    image_info['filename'],
-                    image_info.get('subfolder', ''),
-                    image_info.get('type', 'output')
-                )
-
-                # Determine output filename
-                if isinstance(name, int):
-                    output_filename = f"chapter-{name:02d}.jpg"
-                else:
-                    output_filename = f"{name}.jpg"
-
-                output_path = OUTPUT_DIR / output_filename
-                with open(output_path, 'wb') as f:
-                    f.write(image_data)
-
-                print(f"  Saved: {output_path}")
-                return str(output_path)
-
-    raise ValueError(f"No images in output for {name}")
+    return WORKFLOW.render(prompt=prompt, seed=seed, batch_size=batch_size)
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate Focal Psychology chapter images")
+    parser.add_argument("--window", type=int, default=4,
+                        help="prompts kept queued on each ComfyUI at once (1 = one at a time)")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="seconds per image a backend may finish nothing before its oldest prompt is retried")
+    parser.add_argument("--poll", action="store_true",
+                        help="poll /history instead of listening on the ComfyUI websocket")
+    parser.add_argument("--force", action="store_true",
+                        help="re-render every image even if its cache entry is current")
+    parser.add_argument("--backend", action="append", metavar="URL",
+                        help=f"ComfyUI instance to use, repeat for several (default {COMFYUI_URL})")
+    parser.add_argument("--variants", type=int, default=1, metavar="N",
+                        help="render N candidates per prompt in one batch as chapter-XX.vK.jpg")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR,
+                        help=f"where the images go (default {OUTPUT_DIR})")
+    parser.add_argument("--events", type=Path, metavar="PATH",
+                        help="append a JSON line per queued prompt, retry, error and saved image")
+    parser.add_argument("--report", type=Path, metavar="PATH",
+                        help="write the run summary with per-stage percentiles as JSON")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--select", action="append", default=[], metavar="NAME=K",
+                        help="publish candidate K as the image for NAME (e.g. 7=3 or hero=2)")
+    args = parser.parse_args()
+    backend_urls = args.backend or [COMFYUI_URL]
+    output_dir = args.output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.select:
+        cache = GenerationCache.for_output_dir(output_dir)
+        for selection in args.select:
+            name, index = parse_selection(selection)
+            print(f"Selected: {promote_variant(cache, name, index)} <- v{index}")
+        return
+
     print("=" * 60)
     print("Focal Psychology Image Generator")
     print("=" * 60)
-    print(f"Output directory: {OUTPUT_DIR}")
-    print(f"ComfyUI URL: {COMFYUI_URL}")
+    print(f"Output directory: {output_dir}")
+    print(f"ComfyUI URLs: {', '.join(backend_urls)}")
     print(f"Total images to generate: {len(CHAPTER_PROMPTS)}")
+    print(f"Pipeline window: {args.window}")
     print("=" * 60)
 
-    # Check ComfyUI connection
-    try:
-        with urllib.request.urlopen(f"{COMFYUI_URL}/system_stats") as response:
-            stats = json.loads(response.read())
-            print(f"ComfyUI version: {stats['system']['comfyui_version']}")
-            print(f"PyTorch: {stats['system']['pytorch_version']}")
-    except Exception as e:
-        print(f"ERROR: Cannot connect to ComfyUI at {COMFYUI_URL}")
-        print(f"  {e}")
+    # Check ComfyUI connections
+    clients = connect_backends(backend_urls)
+    if not clients:
         return
 
     print("=" * 60)
 
-    generated = []
-    errors = []
-
-    for name, prompt in CHAPTER_PROMPTS.items():
-        try:
-            path = generate_image(name, prompt)
-            generated.append((name, path))
-            time.sleep(1)  # Small delay between generations
-        except Exception as e:
-            print(f"  ERROR: {e}")
-            errors.append((name, str(e)))
+    cache = GenerationCache.for_output_dir(output_dir)
+    jobs, skipped = plan_jobs(cache, CHAPTER_PROMPTS, create_workflow, Path(__file__).name,
+                              SCRIPT_VERSION, force=args.force, variants=args.variants)
+    print(f"Cached: {len(skipped)}, to render: {len(jobs)}")
+    journal = JobJournal.for_output_dir(output_dir)
+    jobs, attached = reattach_jobs(clients, journal, jobs)
+    metrics = RunMetrics(args.events, args.metrics_port)
+    generated, errors = run_pipeline(clients, jobs, output_dir, window=args.window,
+                                     timeout=args.timeout,
+                                     use_websocket=not args.poll,
+                                     on_saved=lambda name, path: cache.mark_done(Path(path).name),
+                                     journal=journal, attached=attached,
+                                     variants=args.variants, metrics=metrics)
+    if args.report:
+        metrics.write_report(args.report)
+    metrics.close()
 
     print("\n" + "=" * 60)
     print("SUMMARY")
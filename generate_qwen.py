@@ -4,15 +4,22 @@ Qwen Text-to-Image Generator for Focal Psychology Book
 Uses ComfyUI API with proper Qwen workflow nodes
 """
 
-import json
-import time
-import urllib.request
+import argparse
 from pathlib import Path
 import random
 
+from comfy_pipeline import connect_backends, run_pipeline
+from generation_cache import (GenerationCache, JobJournal, parse_selection, plan_jobs,
+                              promote_variant, reattach_jobs)
+from run_metrics import RunMetrics
+from workflow_templates import load_template
+
 COMFYUI_URL = "http://127.0.0.1:8190"
+# Bump when a change outside create_workflow should invalidate cached images
+SCRIPT_VERSION = "1"
+# Graph in workflows/; editing it changes the cache key of every image it renders
+WORKFLOW = load_template("qwen-image.v1")
 OUTPUT_DIR = Path("/mnt/c/Users/PC/focal-psychology/images")
-OUTPUT_DIR.mkdir(exist_ok=True)
 
 # Chapter prompts
 CHAPTER_PROMPTS = {
@@ -71,180 +78,75 @@ CHAPTER_PROMPTS = {
     "topology": "five concentric rings golden center, consciousness topology diagram, ethereal glowing circles cosmic"
 }
 
-def create_workflow(prompt: str, seed: int = None) -> dict:
-    """Create ComfyUI workflow for Qwen text-to-image"""
+def create_workflow(prompt: str, seed: int = None, batch_size: int = 1) -> dict:
+    """ComfyUI workflow for one prompt, from the qwen-image.v1 template"""
     if seed is None:
         seed = random.randint(0, 2147483647)
-
-    return {
-        "1": {
-            "class_type": "UNETLoader",
-            "inputs": {
-                "unet_name": "qwen_image_2512_fp8_e4m3fn.safetensors",
-                "weight_dtype": "default"
-            }
-        },
-        "2": {
-            "class_type": "CLIPLoader",
-            "inputs": {
-                "clip_name": "qwen_2.5_vl_7b_fp8_scaled.safetensors",
-                "type": "qwen_image",
-                "device": "default"
-            }
-        },
-        "3": {
-            "class_type": "VAELoader",
-            "inputs": {
-                "vae_name": "qwen_image_vae.safetensors"
-            }
-        },
-        "4": {
-            "class_type": "LoraLoaderModelOnly",
-            "inputs": {
-                "model": ["1", 0],
-                "lora_name": "Qwen-Image-2512-Lightning-4steps-V1.0-bf16.safetensors",
-                "strength_model": 1.0
-            }
-        },
-        "5": {
-            "class_type": "ModelSamplingAuraFlow",
-            "inputs": {
-                "model": ["4", 0],
-                "shift": 3.1
-            }
-        },
-        "6": {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "clip": ["2", 0],
-                "text": prompt
-            }
-        },
-        "7": {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "clip": ["2", 0],
-                "text": ""
-            }
-        },
-        "8": {
-            "class_type": "EmptySD3LatentImage",
-            "inputs": {
-                "width": 1328,
-                "height": 1328,
-                "batch_size": 1
-            }
-        },
-        "9": {
-            "class_type": "KSampler",
-            "inputs": {
-                "model": ["5", 0],
-                "positive": ["6", 0],
-                "negative": ["7", 0],
-                "latent_image": ["8", 0],
-                "seed": seed,
-                "steps": 4,
-                "cfg": 1.0,
-                "sampler_name": "euler",
-                "scheduler": "simple",
-                "denoise": 1.0
-            }
-        },
-        "10": {
-            "class_type": "VAEDecode",
-            "inputs": {
-                "samples": ["9", 0],
-                "vae": ["3", 0]
-            }
-        },
-        "11": {
-            "class_type": "SaveImage",
-            "inputs": {
-                "images": ["10", 0],
-                "filename_prefix": "focal"
-            }
-        }
-    }
-
-def queue_prompt(workflow: dict) -> str:
-    """Queue a workflow and return the prompt_id"""
-    data = json.dumps({"prompt": workflow}).encode('utf-8')
-    req = urllib.request.Request(f"{COMFYUI_URL}/prompt", data=data)
-    req.add_header('Content-Type', 'application/json')
-    with urllib.request.urlopen(req) as response:
-        return json.loads(response.read())['prompt_id']
-
-def get_history(prompt_id: str) -> dict:
-    """Get the history for a prompt"""
-    with urllib.request.urlopen(f"{COMFYUI_URL}/history/{prompt_id}") as response:
-        return json.loads(response.read())
-
-def get_image(filename: str, subfolder: str, folder_type: str) -> bytes:
-    """Download generated image"""
-    url = f"{COMFYUI_URL}/view?filename={filename}&subfolder={subfolder}&type={folder_type}"
-    with urllib.request.urlopen(url) as response:
-        return response.read()
-
-def wait_for_completion(prompt_id: str, timeout: int = 300) -> dict:
-    """Wait for prompt to complete"""
-    start = time.time()
-    while time.time() - start < timeout:
-        history = get_history(prompt_id)
-        if prompt_id in history:
-            return history[prompt_id]
-        time.sleep(3)
-    raise TimeoutError(f"Timeout for {prompt_id}")
-
-def generate_image(name, prompt: str) -> str:
-    """Generate a single image and save it"""
-    print(f"Generating: {name}")
-    print(f"  Prompt: {prompt[:50]}...")
-
-    workflow = create_workflow(prompt)
-    prompt_id = queue_prompt(workflow)
-    print(f"  Queued: {prompt_id}")
-
-    result = wait_for_completion(prompt_id)
-
-    outputs = result.get('outputs', {})
-    for node_id, node_output in outputs.items():
-        if 'images' in node_output:
-            for img in node_output['images']:
-                data = get_image(img['filename'], img.get('subfolder', ''), img.get('type', 'output'))
-                fname = f"chapter-{name:02d}.jpg" if isinstance(name, int) else f"{name}.jpg"
-                path = OUTPUT_DIR / fname
-                with open(path, 'wb') as f:
-                    f.write(data)
-                print(f"  Saved: {path}")
-                return str(path)
-
-    raise ValueError(f"No images for {name}")
+    return WORKFLOW.render(prompt=prompt, seed=seed, batch_size=batch_size)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Focal Psychology images with Qwen")
+    parser.add_argument("--window", type=int, default=4,
+                        help="prompts kept queued on each ComfyUI at once (1 = one at a time)")
+    parser.add_argument("--timeout", type=int, default=300,
+                        help="seconds per image a backend may finish nothing before its oldest prompt is retried")
+    parser.add_argument("--poll", action="store_true",
+                        help="poll /history instead of listening on the ComfyUI websocket")
+    parser.add_argument("--force", action="store_true",
+                        help="re-render every image even if its cache entry is current")
+    parser.add_argument("--backend", action="append", metavar="URL",
+                        help=f"ComfyUI instance to use, repeat for several (default {COMFYUI_URL})")
+    parser.add_argument("--variants", type=int, default=1, metavar="N",
+                        help="render N candidates per prompt in one batch as chapter-XX.vK.jpg")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR,
+                        help=f"where the images go (default {OUTPUT_DIR})")
+    parser.add_argument("--events", type=Path, metavar="PATH",
+                        help="append a JSON line per queued prompt, retry, error and saved image")
+    parser.add_argument("--report", type=Path, metavar="PATH",
+                        help="write the run summary with per-stage percentiles as JSON")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--select", action="append", default=[], metavar="NAME=K",
+                        help="publish candidate K as the image for NAME (e.g. 7=3 or hero=2)")
+    args = parser.parse_args()
+    backend_urls = args.backend or [COMFYUI_URL]
+    output_dir = args.output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.select:
+        cache = GenerationCache.for_output_dir(output_dir)
+        for selection in args.select:
+            name, index = parse_selection(selection)
+            print(f"Selected: {promote_variant(cache, name, index)} <- v{index}")
+        exit(0)
+
     print("=" * 60)
     print("Focal Psychology Qwen Image Generator")
     print(f"Total: {len(CHAPTER_PROMPTS)} images")
     print("=" * 60)
 
     # Check ComfyUI
-    try:
-        with urllib.request.urlopen(f"{COMFYUI_URL}/system_stats") as r:
-            stats = json.loads(r.read())
-            print(f"ComfyUI: {stats['system']['comfyui_version']}")
-            print(f"PyTorch: {stats['system']['pytorch_version']}")
-    except Exception as e:
-        print(f"ERROR: {e}")
+    clients = connect_backends(backend_urls)
+    if not clients:
         exit(1)
 
     print("=" * 60)
 
-    generated = []
-    for name, prompt in CHAPTER_PROMPTS.items():
-        try:
-            generate_image(name, prompt)
-            generated.append(name)
-            time.sleep(2)
-        except Exception as e:
-            print(f"  ERROR: {e}")
+    cache = GenerationCache.for_output_dir(output_dir)
+    jobs, skipped = plan_jobs(cache, CHAPTER_PROMPTS, create_workflow, Path(__file__).name,
+                              SCRIPT_VERSION, force=args.force, variants=args.variants)
+    print(f"Cached: {len(skipped)}, to render: {len(jobs)}")
+    journal = JobJournal.for_output_dir(output_dir)
+    jobs, attached = reattach_jobs(clients, journal, jobs)
+    metrics = RunMetrics(args.events, args.metrics_port)
+    generated, errors = run_pipeline(clients, jobs, output_dir, window=args.window,
+                                     timeout=args.timeout, poll_interval=1.5,
+                                     use_websocket=not args.poll,
+                                     on_saved=lambda name, path: cache.mark_done(Path(path).name),
+                                     journal=journal, attached=attached,
+                                     variants=args.variants, metrics=metrics)
+    if args.report:
+        metrics.write_report(args.report)
+    metrics.close()
 
     print(f"\nGenerated {len(generated)} / {len(CHAPTER_PROMPTS)} images")
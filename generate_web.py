@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Site renderer for Focal Psychology
+Builds chapters/*.html and index.html from content/chapters/*.md and templates/,
+re-rendering only pages whose inputs changed. Pages come out as the build steps
+expect them (Google Fonts links, inline <style>); run build_images.py,
+build_css.py, build_fonts.py, build_search.py, build_techniques.py,
+build_assets.py and build_sitemap.py afterwards, in that order
+"""
+
+import argparse
+import json
+import re
+import sys
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from string import Template
+
+from build_assets import REGISTRATION
+from build_css import SHARED_LINK
+from build_images import MANIFEST_PATH, PICTURE, rewrite_page
+from site_build import (CHAPTERS_DIR, INDEX_PAGE, ROOT, file_hash, load_json, sha256_bytes,
+                        write_if_changed, write_json, write_text)
+from site_markdown import equivalent, html_to_markdown, parse_html, render_markdown, to_html
+
+CONTENT_DIR = ROOT / "content" / "chapters"
+TEMPLATES_DIR = ROOT / "templates"
+STYLES_DIR = TEMPLATES_DIR / "styles"
+CHAPTER_TEMPLATE = TEMPLATES_DIR / "chapter.html"
+INDEX_TEMPLATE = TEMPLATES_DIR / "index.html"
+STATE_PATH = ROOT / "web.deps.json"
+# Bump when rendering changes in a way the inputs do not show
+RENDERER_VERSION = 1
+# Below this many stale pages a process pool costs more than it saves
+PARALLEL_THRESHOLD = 4
+
+# Front matter key -> (class, default tag) of the chapter header lines, in page order
+HEADER_FIELDS = {
+    "badge": ("map-badge", "div"),
+    "symbol": ("intro-symbol", "div"),
+    "part_label": ("part-label", "div"),
+    "number": ("chapter-number", "div"),
+    "title": ("chapter-title", "h1"),
+    "subtitle": ("chapter-subtitle", "p"),
+}
+LINK_FIELDS = ("nav_prev", "nav_next", "footer_prev", "footer_next")
+FIELD_ORDER = (["page_title", "style", "position", *LINK_FIELDS, *HEADER_FIELDS]
+               + [f"{field}_tag" for field in HEADER_FIELDS] + ["image", "image_alt", "toc", "menu_icon"])
+# Inside the floating menu button's <svg>, unless a page's front matter says otherwise
+MENU_ICON = '<path d="M3 12h18M3 6h18M3 18h18"/>'
+CONTENT_DEPTH = 2
+TOC_INDENT = " " * 28
+
+FRONT_MATTER = re.compile(r"\A---\n(.*?)\n---\n", re.S)
+IMAGE_REFERENCE = re.compile(r"images/([\w.-]+)")
+CHAPTER_LIST = re.compile(r'(<div class="chapter-list">)(.*?)(\n\s*</div>)', re.S)
+PART_COUNT = re.compile(r'(<div class="part-chapters">)(\d+)(</div>)')
+MENU_SVG = re.compile(r'class="floating-menu-btn".*?<svg[^>]*>(.*?)</svg>', re.S)
+# What the build steps leave in a page; --import needs the HTML as rendered, before them
+BUILT_MARKUP = {
+    "build_images.py <picture>": PICTURE,
+    "build_css.py stylesheet link": SHARED_LINK,
+    # build_fonts.py output; not imported from there because that needs fontTools
+    "build_fonts.py fonts": re.compile(r'<style id="font-faces">|<link rel="preload" href="[^"]*fonts/'),
+    "build_assets.py service worker": REGISTRATION,
+}
+TOC_ITEM = re.compile(r'<a href="chapters/([^"]+)\.html" class="chapter-item"><span class="chapter-num">'
+                      r'([^<]*)</span><span class="chapter-title">([^<]*)</span></a>')
+
+
+def parse_source(text: str):
+    """Markdown source -> (front matter dict, markdown body)"""
+    match = FRONT_MATTER.match(text)
+    if not match:
+        return {}, text
+    meta = {}
+    for line in match.group(1).split("\n"):
+        key, _, value = line.partition(":")
+        if key.strip():
+            meta[key.strip()] = value.strip()
+    return meta, text[match.end():]
+
+
+def format_source(meta: dict, body: str) -> str:
+    keys = [k for k in FIELD_ORDER if k in meta] + [k for k in meta if k not in FIELD_ORDER]
+    lines = "".join(f"{key}: {meta[key]}\n" for key in keys)
+    return f"---\n{lines}---\n\n{body}"
+
+
+def split_link(value: str):
+    href, _, label = value.partition(" | ")
+    return href, label
+
+
+def natural_key(slug: str):
+    """intro first, then chapters by number: 00-1 < 09 < 22 < 22a < 23"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", slug)]
+
+
+@lru_cache(maxsize=None)
+def read_template(path: Path) -> Template:
+    return Template(path.read_text(encoding="utf-8"))
+
+
+@lru_cache(maxsize=None)
+def read_style(name: str) -> str:
+    return (STYLES_DIR / f"{name}.css").read_text(encoding="utf-8")
+
+
+@lru_cache(maxsize=None)
+def read_manifest() -> dict:
+    return load_json(MANIFEST_PATH, {})
+
+
+def load_sources() -> dict:
+    """slug -> (front matter, body) for every chapter source"""
+    return {path.stem: parse_source(path.read_text(encoding="utf-8"))
+            for path in sorted(CONTENT_DIR.glob("*.md"), key=lambda p: natural_key(p.stem))}
+
+
+# --- rendering ---------------------------------------------------------------
+
+def header_markup(meta: dict) -> str:
+    lines = []
+    for field, (css_class, default_tag) in HEADER_FIELDS.items():
+        if field in meta:
+            tag = meta.get(f"{field}_tag", default_tag)
+            lines.append(f'        <{tag} class="{css_class}">{meta[field]}</{tag}>')
+    return "\n".join(lines)
+
+
+def image_markup(meta: dict) -> str:
+    if "image" not in meta:
+        return ""
+    return ("\n    <div class=\"chapter-image-container\">\n"
+            f"        <img src=\"../images/{meta['image']}\" alt=\"{meta.get('image_alt', '')}\" "
+            "class=\"chapter-image\">\n    </div>\n")
+
+
+def render_chapter(meta: dict, body: str, style: str) -> str:
+    values = {
+        "page_title": meta.get("page_title", ""),
+        "style": textwrap.indent(style.strip("\n"), " " * 8),
+        "position": meta.get("position", ""),
+        "header": header_markup(meta),
+        "image": image_markup(meta),
+        "content": render_markdown(body, CONTENT_DEPTH),
+        "menu_icon": meta.get("menu_icon", MENU_ICON),
+    }
+    for field in LINK_FIELDS:
+        values[f"{field}_href"], values[f"{field}_label"] = split_link(meta.get(field, ""))
+    return read_template(CHAPTER_TEMPLATE).substitute(values)
+
+
+def toc_markup(sources: dict) -> dict:
+    """Template values for the table of contents on the index page"""
+    parts = {}
+    for slug, (meta, _) in sources.items():
+        if "toc" in meta:
+            part, number, title = (meta["toc"].split(" | ", 2) + ["", ""])[:3]
+            parts.setdefault(part, []).append(
+                f'{TOC_INDENT}<a href="chapters/{slug}.html" class="chapter-item">'
+                f'<span class="chapter-num">{number}</span><span class="chapter-title">{title}</span></a>')
+    values = {}
+    for part, items in parts.items():
+        values[f"part_{part}"] = "\n".join(items)
+        values[f"part_{part}_count"] = str(len(items))
+    return values
+
+
+def with_images(html: str) -> str:
+    manifest = read_manifest()
+    return rewrite_page(html, manifest) if manifest else html
+
+
+def render_page(page: str) -> str:
+    """Full HTML of one output page; runs in a worker process"""
+    sources = load_sources()
+    if page == "index.html":
+        html = read_template(INDEX_TEMPLATE).safe_substitute(toc_markup(sources))
+    else:
+        meta, body = sources[Path(page).stem]
+        html = render_chapter(meta, body, read_style(meta["style"]))
+    return with_images(html)
+
+
+# --- dependencies ------------------------------------------------------------
+
+def digest(*inputs) -> str:
+    return sha256_bytes(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+
+def image_entries(text: str) -> dict:
+    manifest = read_manifest()
+    return {name: manifest.get(name) for name in sorted(set(IMAGE_REFERENCE.findall(text)))}
+
+
+def page_inputs(sources: dict) -> dict:
+    """
+    Output page -> digest of everything it is rendered from.
+
+    A chapter depends on its source, the chapter template, its stylesheet and
+    the manifest entries of the images it shows. The index depends on its
+    template and only the table-of-contents lines of the chapters, so editing
+    a chapter's text does not re-render it.
+    """
+    chapter_template = file_hash(CHAPTER_TEMPLATE)
+    inputs = {}
+    for slug, (meta, body) in sources.items():
+        source = format_source(meta, body)
+        inputs[f"chapters/{slug}.html"] = digest(
+            RENDERER_VERSION, chapter_template, file_hash(STYLES_DIR / f"{meta['style']}.css"),
+            source, image_entries(f"images/{meta.get('image', '')} {body}"))
+    if INDEX_TEMPLATE.exists():
+        template = INDEX_TEMPLATE.read_text(encoding="utf-8")
+        inputs["index.html"] = digest(RENDERER_VERSION, sha256_bytes(template.encode("utf-8")),
+                                      toc_markup(sources), image_entries(template))
+    return inputs
+
+
+def build(force: bool = False, workers: int = None) -> None:
+    started = time.time()
+    sources = load_sources()
+    if not sources:
+        print(f"No sources in {CONTENT_DIR}, bootstrap them with --import")
+        return
+    inputs = page_inputs(sources)
+    state = load_json(STATE_PATH, {})
+    stale = [page for page, key in inputs.items()
+             if force or state.get(page) != key or not (ROOT / page).exists()]
+    print(f"Pages: {len(inputs)}, up to date: {len(inputs) - len(stale)}, to render: {len(stale)}")
+
+    if len(stale) >= PARALLEL_THRESHOLD and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = dict(zip(stale, pool.map(render_page, stale, chunksize=4)))
+    else:
+        rendered = {page: render_page(page) for page in stale}
+
+    written = 0
+    for page, html in rendered.items():
+        if write_if_changed(ROOT / page, html):
+            written += 1
+        state[page] = inputs[page]
+    write_json(STATE_PATH, {page: key for page, key in state.items() if page in inputs})
+    print(f"Pages written: {written} ({time.time() - started:.2f}s)")
+
+
+# --- bootstrap from the existing HTML ----------------------------------------
+
+def children_html(node) -> str:
+    return "".join(to_html(child) for child in node.children).strip()
+
+
+def first_element(markup: str, tag: str):
+    for node in parse_html(markup).children:
+        if not isinstance(node, str) and node.tag == tag:
+            return node
+    return None
+
+
+def import_chapter(html: str, toc: dict, slug: str):
+    """Front matter, markdown body and CSS of one existing chapter page"""
+    head, _, body = html.partition("</head>")
+    main = re.search(r'<main class="chapter-content">(.*)</main>', body, re.S)
+    after_main = body[main.end():]
+    meta = {"page_title": re.search(r"<title>(.*?)</title>", head, re.S).group(1)}
+
+    styles = re.findall(r"<style>(.*?)</style>", head, re.S)
+    styles += re.findall(r"<style>(.*?)</style>", after_main, re.S)
+    css = "\n\n".join(textwrap.dedent(s.strip("\n")).strip() for s in styles) + "\n"
+
+    nav = first_element(re.search(r'<nav class="chapter-nav">.*?</nav>', body, re.S).group(0), "nav")
+    links = [n for n in nav.children if not isinstance(n, str) and n.tag == "a"]
+    span = next(n for n in nav.children if not isinstance(n, str) and n.tag == "span")
+    meta["position"] = children_html(span)
+    for field, link in zip(("nav_prev", "nav_next"), links):
+        meta[field] = f"{dict(link.attrs)['href']} | {children_html(link)}"
+
+    footer = first_element(re.search(r'<footer class="chapter-footer">.*?</footer>', after_main,
+                                     re.S).group(0), "footer")
+    links = [n for n in footer.children if not isinstance(n, str) and n.tag == "a"]
+    for field, link in zip(("footer_prev", "footer_next"), links):
+        meta[field] = f"{dict(link.attrs)['href']} | {children_html(link)}"
+
+    by_class = {css_class: (field, tag) for field, (css_class, tag) in HEADER_FIELDS.items()}
+    header = first_element(re.search(r'<header class="chapter-header">.*?</header>', body,
+                                     re.S).group(0), "header")
+    for node in header.children:
+        if isinstance(node, str):
+            continue
+        field, tag = by_class[dict(node.attrs)["class"]]
+        meta[field] = children_html(node)
+        if node.tag != tag:
+            meta[f"{field}_tag"] = node.tag
+
+    image = re.search(r'<img src="\.\./images/([^"]+)" alt="([^"]*)" class="chapter-image">', body)
+    if image:
+        meta["image"], meta["image_alt"] = image.group(1), image.group(2)
+    if slug in toc:
+        meta["toc"] = " | ".join(toc[slug])
+    icon = MENU_SVG.search(after_main)
+    if icon and not equivalent(icon.group(1), MENU_ICON):
+        meta["menu_icon"] = " ".join(icon.group(1).split())
+    return meta, html_to_markdown(main.group(1)), css
+
+
+def import_index(html: str):
+    """Index template with the table of contents replaced by placeholders, and slug -> toc entry"""
+    toc = {}
+    cards = html.split('<div class="part-card')
+    for part, card in enumerate(cards[1:]):
+        items = TOC_ITEM.findall(card)
+        for slug, number, title in items:
+            toc[slug] = (str(part), number, title)
+        card = CHAPTER_LIST.sub(lambda m: f"{m.group(1)}\n${{part_{part}}}{m.group(3)}", card, count=1)
+        if PART_COUNT.search(card) and PART_COUNT.search(card).group(2) == str(len(items)):
+            card = PART_COUNT.sub(lambda m: f"{m.group(1)}${{part_{part}_count}}{m.group(3)}", card, count=1)
+        cards[part + 1] = card
+    return '<div class="part-card'.join(cards), toc
+
+
+def without_styles(html: str) -> str:
+    return re.sub(r"<style>.*?</style>", "", html, flags=re.S)
+
+
+def built_markup(html: str) -> list:
+    return [name for name, pattern in BUILT_MARKUP.items() if pattern.search(html)]
+
+
+def import_site(force: bool = False) -> None:
+    """Write content/ and templates/ from the current HTML once they are checked to render it back"""
+    if any(CONTENT_DIR.glob("*.md")) and not force:
+        print(f"{CONTENT_DIR} already has sources; use --force to overwrite them")
+        return
+    index_html = INDEX_PAGE.read_text(encoding="utf-8")
+    template, toc = import_index(index_html)
+
+    styles = {}  # CSS text -> style name
+    sources = {}
+    for page in sorted(CHAPTERS_DIR.glob("*.html"), key=lambda p: natural_key(p.stem)):
+        html = page.read_text(encoding="utf-8")
+        if '<main class="chapter-content">' not in html:
+            print(f"  Skipped: {page.name} (not a chapter page)")
+            continue
+        meta, body, css = import_chapter(html, toc, page.stem)
+        meta["style"] = styles.setdefault(css, page.stem)
+        sources[page.stem] = (meta, body, css, html)
+
+    # Every page must render back to what the browser showed before; nothing is written otherwise
+    built = {"index.html": built_markup(index_html)}
+    mismatches = []
+    for slug, (meta, body, css, html) in sources.items():
+        built[f"chapters/{slug}.html"] = built_markup(html)
+        rendered = render_chapter(meta, body, css)
+        css_same = equivalent(" ".join(re.findall(r"<style>(.*?)</style>", rendered, re.S)),
+                              " ".join(re.findall(r"<style>(.*?)</style>", html, re.S)))
+        if not (css_same and equivalent(without_styles(rendered), without_styles(html))):
+            mismatches.append(f"chapters/{slug}.html")
+    index = Template(template).safe_substitute(
+        toc_markup({slug: (meta, body) for slug, (meta, body, _, _) in sources.items()}))
+    if not equivalent(index, index_html):
+        mismatches.append("index.html")
+    built = {page: names for page, names in built.items() if names}
+    print(f"Round trip: {len(sources) + 1 - len(mismatches)} pages identical")
+    for page in mismatches:
+        print(f"  DIFFERS: {page}")
+    for page, names in built.items():
+        print(f"  BUILT: {page} ({', '.join(names)})")
+    if mismatches or built:
+        print("Nothing written: import the pages as generate_web.py renders them, before the build steps")
+        sys.exit(1)
+
+    write_text(INDEX_TEMPLATE, template)
+    for css, name in styles.items():
+        write_text(STYLES_DIR / f"{name}.css", css)
+    for slug, (meta, body, _, _) in sources.items():
+        write_text(CONTENT_DIR / f"{slug}.md", format_source(meta, body))
+    print(f"Imported {len(sources)} chapters with {len(styles)} distinct stylesheets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the Focal Psychology site from markdown")
+    parser.add_argument("--force", action="store_true",
+                        help="re-render every page (with --import: overwrite existing sources)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--import", dest="bootstrap", action="store_true",
+                        help="create content/ and templates/ from the current HTML pages")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Focal Psychology Site Renderer")
+    print("=" * 60)
+    if args.bootstrap:
+        import_site(force=args.force)
+    else:
+        build(force=args.force, workers=args.jobs)
+
+
+if __name__ == "__main__":
+    main()
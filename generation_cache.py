@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache and job journal for generated Focal Psychology images
+Skips prompts whose workflow is unchanged and reattaches to interrupted runs
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from comfy_pipeline import output_filename, variant_filename
+
+CACHE_FORMAT = 1
+
+
+def cache_key(script: str, version: str, workflow: dict) -> str:
+    """Hash of everything that determines the image: the full graph and the script version"""
+    payload = json.dumps({"script": script, "version": version, "workflow": workflow},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def default_seed(filename: str) -> int:
+    """Stable seed for an output that has none recorded yet"""
+    digest = hashlib.sha256(filename.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') % 2147483647
+
+
+def write_json(path: Path, data) -> None:
+    """Write JSON through a temporary file so readers never see half a file"""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, path)
+
+
+class GenerationCache:
+    """
+    Manifest of rendered outputs, stored next to the output directory.
+
+    Each entry records the cache key and seed an output file was rendered
+    with. Seeds are kept so a cache hit can always be reproduced.
+    """
+
+    def __init__(self, path: Path, output_dir: Path):
+        self.path = path
+        self.output_dir = output_dir
+        self.entries = {}
+        self._staged = {}
+        if path.exists():
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == CACHE_FORMAT:
+                self.entries = data.get('entries', {})
+
+    @classmethod
+    def for_output_dir(cls, output_dir: Path) -> "GenerationCache":
+        return cls(output_dir.with_name(f"{output_dir.name}.cache.json"), output_dir)
+
+    def seed(self, filename: str) -> int:
+        entry = self.entries.get(filename)
+        if entry is not None:
+            return entry['seed']
+        return default_seed(filename)
+
+    def is_fresh(self, filename: str, key: str) -> bool:
+        entry = self.entries.get(filename)
+        return (entry is not None and entry['key'] == key
+                and (self.output_dir / filename).exists())
+
+    def stage(self, filename: str, key: str, seed: int, prompt: str, variant: dict = None) -> None:
+        """Remember what a dispatched job will produce until it is saved"""
+        self._staged[filename] = {"key": key, "seed": seed, "prompt": prompt}
+        if variant is not None:
+            self._staged[filename]['variant'] = variant
+
+    def mark_done(self, filename: str) -> None:
+        """Record a staged output as rendered and persist the manifest"""
+        entry = self._staged.pop(filename)
+        entry['rendered'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.entries[filename] = entry
+        self.save()
+
+    def save(self) -> None:
+        write_json(self.path, {"format": CACHE_FORMAT, "entries": self.entries})
+
+
+def plan_jobs(cache: GenerationCache, prompts: dict, create_workflow, script: str,
+              version: str, force: bool = False, variants: int = 1):
+    """
+    Build (name, workflow) jobs for the prompts whose outputs are stale.
+
+    With `variants` > 1 each job renders a batch of candidates from the
+    prompt's stored seed; candidate i is batch index i-1 of that seed, which
+    is what the manifest records so any candidate can be reproduced.
+
+    Returns (jobs, skipped) where skipped lists the names served from cache.
+    """
+    jobs = []
+    skipped = []
+    for name, prompt in prompts.items():
+        filename = output_filename(name)
+        seed = cache.seed(filename)
+        if variants > 1:
+            workflow = create_workflow(prompt, seed, batch_size=variants)
+            key = cache_key(script, version, workflow)
+            files = [variant_filename(name, i + 1) for i in range(variants)]
+            if not force and all(cache.is_fresh(f, key) for f in files):
+                skipped.append(name)
+                continue
+            for index, variant_file in enumerate(files):
+                cache.stage(variant_file, key, seed, prompt,
+                            variant={"batch": variants, "index": index})
+            jobs.append((name, workflow))
+            continue
+
+        # A promoted candidate stays fresh as long as its batch would be unchanged
+        entry = cache.entries.get(filename, {})
+        batch = entry.get('variant', {}).get('batch', 1)
+        if not force and batch > 1:
+            key = cache_key(script, version, create_workflow(prompt, seed, batch_size=batch))
+            if cache.is_fresh(filename, key):
+                skipped.append(name)
+                continue
+        workflow = create_workflow(prompt, seed)
+        key = cache_key(script, version, workflow)
+        if not force and cache.is_fresh(filename, key):
+            skipped.append(name)
+            continue
+        cache.stage(filename, key, seed, prompt)
+        jobs.append((name, workflow))
+    return jobs, skipped
+
+
+def parse_selection(text: str):
+    """Parse NAME=K from the command line into (CHAPTER_PROMPTS key, K)"""
+    name, _, index = text.partition('=')
+    if not index.isdigit():
+        raise ValueError(f"Expected NAME=K, got {text!r}")
+    return (int(name) if name.isdigit() else name), int(index)
+
+
+def promote_variant(cache: GenerationCache, name, index: int) -> Path:
+    """Make candidate `index` of a variants sweep the published image for `name`"""
+    source = cache.output_dir / variant_filename(name, index)
+    target = cache.output_dir / output_filename(name)
+    entry = cache.entries.get(source.name)
+    if entry is None or not source.exists():
+        raise FileNotFoundError(f"No rendered variant {source.name}")
+    tmp = target.with_name(target.name + '.tmp')
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+    cache.entries[target.name] = dict(entry, promoted=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    cache.save()
+    return target
+
+
+def workflow_digest(workflow: dict) -> str:
+    payload = json.dumps(workflow, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class JobJournal:
+    """
+    Append-only log of submitted prompts: output file -> prompt_id -> state.
+
+    States are queued, running, downloaded and failed. The latest record per
+    output file wins, so after a crash the next run knows which prompts
+    ComfyUI may still be working on.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.latest = {}  # output filename -> latest record
+        self._files = {}  # prompt_id -> output filename
+        self._lock = threading.Lock()
+        if path.exists():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    self.latest[record['file']] = record
+                    self._files[record['prompt_id']] = record['file']
+            self.compact()
+
+    @classmethod
+    def for_output_dir(cls, output_dir: Path) -> "JobJournal":
+        return cls(output_dir.with_name(f"{output_dir.name}.journal.jsonl"))
+
+    def compact(self) -> None:
+        """Rewrite the log with one line per output that is not yet downloaded"""
+        self.latest = {f: r for f, r in self.latest.items() if r['state'] in ('queued', 'running')}
+        self._files = {r['prompt_id']: f for f, r in self.latest.items()}
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in self.latest.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp, self.path)
+
+    def _append(self, record: dict) -> None:
+        record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with self._lock:
+            self.latest[record['file']] = record
+            self._files[record['prompt_id']] = record['file']
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def queued(self, name, prompt_id: str, workflow: dict, client) -> None:
+        self._append({"file": output_filename(name), "prompt_id": prompt_id, "state": "queued",
+                      "workflow": workflow_digest(workflow), "backend": client.url,
+                      "client_id": client.client_id})
+
+    def update(self, prompt_id: str, state: str) -> None:
+        record = self.latest.get(self._files.get(prompt_id))
+        if record is None or record['prompt_id'] != prompt_id:
+            return  # superseded by a newer submission for the same file
+        self._append(dict(record, state=state))
+
+    def unfinished(self, name, workflow: dict):
+        """The queued/running record for this exact workflow, if any"""
+        record = self.latest.get(output_filename(name))
+        if (record is not None and record['state'] in ('queued', 'running')
+                and record['workflow'] == workflow_digest(workflow)):
+            return record
+        return None
+
+
+def reattach_jobs(clients, journal: JobJournal, jobs):
+    """
+    Split jobs into (to_submit, attached) using the journal of a previous run.
+
+    A journalled prompt is reattached if its backend still has it queued or
+    already has it in /history. attached maps backend URL -> {prompt_id:
+    (name, workflow)}, the shape run_pipeline expects. Each client adopts the
+    previous run's client_id so websocket events for reattached prompts reach us.
+    """
+    by_url = {client.url: client for client in clients}
+    candidates = [(name, workflow, journal.unfinished(name, workflow)) for name, workflow in jobs]
+
+    queued = {}  # backend URL -> prompt_ids it has running or pending
+    for url in {record['backend'] for _, _, record in candidates if record is not None}:
+        if url not in by_url:
+            continue
+        try:
+            queued[url] = by_url[url].queued_prompt_ids()
+        except Exception as e:
+            print(f"  WARNING: cannot read queue of {url} ({e}), resubmitting its jobs")
+
+    to_submit = []
+    attached = {}
+    for name, workflow, record in candidates:
+        if record is not None and record['backend'] in queued:
+            client = by_url[record['backend']]
+            prompt_id = record['prompt_id']
+            try:
+                known = (prompt_id in queued[client.url]
+                         or prompt_id in client.get_history(prompt_id))
+            except Exception:
+                known = False
+            if known:
+                attached.setdefault(client.url, {})[prompt_id] = (name, workflow)
+                client.client_id = record['client_id']
+                print(f"Reattached: {name} -> {prompt_id}")
+                continue
+        to_submit.append((name, workflow))
+    return to_submit, attached
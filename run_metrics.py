@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Per-image stage timings for Focal Psychology generation runs
+Records where each image's time went, writes JSON-lines events and a summary
+report, and can serve the running totals in Prometheus text format
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Where an image's time goes, in order: waiting for a window slot, waiting in
+# the ComfyUI queue, executing, finished but not yet noticed, downloading
+STAGES = ('queue', 'comfy_wait', 'execution', 'poll_slack', 'download')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(values, share: float) -> float:
+    """Nearest-rank percentile; 0 for no values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(share * len(values) + 0.5) - 1))]
+
+
+def execution_window(result: dict) -> tuple:
+    """
+    (start, end) epoch seconds of a finished prompt, None where unknown.
+
+    Taken from the timestamps ComfyUI puts on the status messages of a
+    history entry; CompletionListener stamps its results the same way.
+    """
+    start = end = None
+    for message in result.get('status', {}).get('messages', []):
+        kind, data = message[0], message[1] if len(message) > 1 else None
+        if not isinstance(data, dict) or data.get('timestamp') is None:
+            continue
+        if kind == 'execution_start':
+            start = data['timestamp'] / 1000
+        elif kind in ('execution_success', 'execution_error', 'execution_interrupted'):
+            end = data['timestamp'] / 1000
+    return start, end
+
+
+def stage_times(ready: float, submitted: float, start, end, collected: float, saved: float) -> dict:
+    """
+    Seconds per stage from the moments an image passed through.
+
+    Stages whose boundaries are unknown (a prompt reattached from an earlier
+    run, or a ComfyUI without timestamps) are None. Backend clocks may differ
+    from ours by a little, so negative spans count as 0.
+    """
+    def span(a, b):
+        return None if a is None or b is None else round(max(0.0, b - a), 3)
+
+    return {'queue': span(ready, submitted),
+            'comfy_wait': span(submitted, start),
+            'execution': span(start, end),
+            'poll_slack': span(end, collected),
+            'download': span(collected, saved)}
+
+
+class RunMetrics:
+    """
+    Collects what happens to every job of a run_pipeline call.
+
+    Every record is appended to `events_path` as one JSON line when given;
+    `summary()` folds them into per-stage percentiles and per-backend totals.
+    With `metrics_port` the running totals are served at /metrics in the
+    Prometheus text format until close().
+    """
+
+    def __init__(self, events_path: Path = None, metrics_port: int = None):
+        self.started = time.time()
+        self.images = []  # image records
+        self.retries = 0
+        self.errors = 0
+        self.backends = {}  # url -> {'images', 'bytes', 'retries', 'errors'}
+        self.pending = 0
+        self.in_flight = {}  # url -> prompts
+        self._lock = threading.Lock()
+        self._events = open(events_path, 'a', encoding='utf-8') if events_path else None
+        self._server = None
+        if metrics_port is not None:
+            self._server = ThreadingHTTPServer(('127.0.0.1', metrics_port), self._handler_class())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            print(f"Metrics: http://127.0.0.1:{self._server.server_address[1]}/metrics")
+        self.event('run_start')
+
+    def event(self, kind: str, **fields) -> None:
+        if self._events is None:
+            return
+        record = {'event': kind, 'time': round(time.time(), 3), **fields}
+        with self._lock:
+            self._events.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._events.flush()
+
+    def _backend(self, url: str) -> dict:
+        return self.backends.setdefault(url, {'images': 0, 'bytes': 0, 'retries': 0, 'errors': 0})
+
+    def queued(self, name, prompt_id: str, backend: str, attempt: int) -> None:
+        self.event('queued', name=name, prompt_id=prompt_id, backend=backend, attempt=attempt)
+
+    def retry(self, name, backend: str, message: str) -> None:
+        with self._lock:
+            self.retries += 1
+            self._backend(backend)['retries'] += 1
+        self.event('retry', name=name, backend=backend, message=message)
+
+    def failed(self, name, backend, message: str) -> None:
+        with self._lock:
+            self.errors += 1
+            if backend is not None:
+                self._backend(backend)['errors'] += 1
+        self.event('error', name=name, backend=backend, message=message)
+
+    def image(self, name, prompt_id: str, backend: str, attempts: int, stages: dict,
+              total: float, files: list, size: int) -> None:
+        """One finished job: its stage seconds, its end-to-end seconds and what was downloaded"""
+        record = {'name': name, 'prompt_id': prompt_id, 'backend': backend, 'attempts': attempts,
+                  **stages, 'total': round(total, 3), 'files': files, 'bytes': size}
+        with self._lock:
+            self.images.append(record)
+            counts = self._backend(backend)
+            counts['images'] += len(files)
+            counts['bytes'] += size
+        self.event('image', **record)
+
+    def set_load(self, pending: int, in_flight: dict) -> None:
+        """Jobs waiting for a slot and prompts in flight per backend, for the gauges"""
+        self.pending = pending
+        self.in_flight = dict(in_flight)
+
+    def summary(self) -> dict:
+        with self._lock:
+            images = list(self.images)
+            backends = {url: dict(counts) for url, counts in self.backends.items()}
+        seconds = time.time() - self.started
+        files = sum(len(r['files']) for r in images)
+        stages = {}
+        for stage in STAGES + ('total',):
+            values = [r[stage] for r in images if r.get(stage) is not None]
+            stages[stage] = {'count': len(values), 'sum': round(sum(values), 3),
+                             'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+                             'max': max(values, default=0.0)}
+        return {'seconds': round(seconds, 2), 'jobs': len(images), 'images': files,
+                'images_per_minute': round(files * 60 / seconds, 1) if seconds else 0.0,
+                'bytes': sum(r['bytes'] for r in images), 'retries': self.retries,
+                'errors': self.errors, 'stages': stages, 'backends': backends}
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+        print(f"Stage timings over {summary['jobs']} jobs (p50 / p95 / max seconds):")
+        for stage, values in summary['stages'].items():
+            if values['count']:
+                print(f"  {stage:<11} {values['p50']:>7.2f} {values['p95']:>7.2f} {values['max']:>7.2f}")
+        print(f"Throughput: {summary['images_per_minute']} images/min, "
+              f"{summary['bytes'] // 1024} KB downloaded, {summary['retries']} retries")
+
+    def write_report(self, path: Path) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+    def prometheus(self) -> str:
+        """The running totals in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        backends = summary['backends']
+        metric('focal_images_total', 'counter', 'Images saved',
+               [({'backend': url}, c['images']) for url, c in backends.items()])
+        metric('focal_download_bytes_total', 'counter', 'Bytes downloaded from ComfyUI',
+               [({'backend': url}, c['bytes']) for url, c in backends.items()])
+        metric('focal_retries_total', 'counter', 'Jobs moved to another backend',
+               [({'backend': url}, c['retries']) for url, c in backends.items()])
+        metric('focal_errors_total', 'counter', 'Jobs given up on', [({}, summary['errors'])])
+        metric('focal_pending_jobs', 'gauge', 'Jobs waiting for a window slot', [({}, self.pending)])
+        metric('focal_in_flight_prompts', 'gauge', 'Prompts queued or running on a backend',
+               [({'backend': url}, count) for url, count in self.in_flight.items()])
+        metric('focal_run_seconds', 'gauge', 'Seconds since the run started', [({}, summary['seconds'])])
+
+        with self._lock:
+            images = list(self.images)
+        lines.append("# HELP focal_stage_seconds Seconds each image spent per stage")
+        lines.append("# TYPE focal_stage_seconds summary")
+        for stage in STAGES + ('total',):
+            values = [r[stage] for r in images if r.get(stage) is not None]
+            for q in QUANTILES:
+                lines.append(f'focal_stage_seconds{{stage="{stage}",quantile="{q}"}} {percentile(values, q)}')
+            lines.append(f'focal_stage_seconds_sum{{stage="{stage}"}} {round(sum(values), 3)}')
+            lines.append(f'focal_stage_seconds_count{{stage="{stage}"}} {len(values)}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self) -> None:
+        self.event('run_end', **{k: v for k, v in self.summary().items() if k != 'backends'})
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _handler_class(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
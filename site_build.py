@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the Focal Psychology static site build
+Paths, content hashing and atomic writes used by the build_*.py tools
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+CHAPTERS_DIR = ROOT / "chapters"
+IMAGES_DIR = ROOT / "images"
+INDEX_PAGE = ROOT / "index.html"
+SITE_URL = "https://jetmil.github.io/focal-psychology"
+
+
+def page_paths() -> list:
+    """Every HTML page of the site: index.html first, then the chapters"""
+    return [INDEX_PAGE] + sorted(CHAPTERS_DIR.glob("*.html"))
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_bytes(path: Path, data: bytes) -> None:
+    """Write through a temporary file so the site never serves half a file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_text(path: Path, text: str) -> None:
+    write_bytes(path, text.encode('utf-8'))
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """Write text unless the file already has exactly this content"""
+    if path.exists() and path.read_text(encoding='utf-8') == text:
+        return False
+    write_text(path, text)
+    return True
+
+
+def load_json(path: Path, default=None):
+    if not path.exists():
+        return default
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json(path: Path, data) -> None:
+    write_text(path, json.dumps(data, indent=1, ensure_ascii=False, sort_keys=True) + "\n")
+
+
+def site_relative(path: Path) -> str:
+    """Path of a site file relative to the site root, with forward slashes"""
+    return path.resolve().relative_to(ROOT.resolve()).as_posix()
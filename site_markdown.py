@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Markdown dialect for Focal Psychology chapters
+Renders chapter markdown to the site's HTML and converts existing HTML back
+
+Blocks are separated by blank lines:
+
+    # Heading, - item, 1. item, > quote, --- and plain paragraphs
+    {.lead #intro}                  attributes for the block that follows
+    ::: technique-card              a container with block content, up to
+    ...                             the matching bare ::: line
+    :::
+    :: technique-number @span :: 5.1    one element with inline content
+    <div ...>...</div>              raw HTML, up to the next blank line
+
+In attribute specs bare words and .words are classes, #word is the id,
+@word the tag (div by default) and key="value" any other attribute.
+Inline: **strong**, *em*, [text](href), [text]{.class} for a span,
+:icon-clock: for the meta icons and \\ before punctuation for a literal.
+"""
+
+import html
+import re
+from html.parser import HTMLParser
+
+INDENT = "    "
+VOID_TAGS = {"area", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "body", "dd", "details", "div", "dl", "dt",
+              "figcaption", "figure", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "head", "header",
+              "hr", "html", "li", "main", "nav", "ol", "p", "pre", "section", "table", "tbody", "td",
+              "th", "thead", "tr", "ul", "style", "script", "noscript", "picture", "source"}
+INLINE_TAGS = {"a", "abbr", "b", "br", "cite", "code", "em", "i", "img", "kbd", "mark", "q", "s",
+               "small", "span", "strong", "sub", "sup", "svg", "time", "u"}
+HEADINGS = {f"h{n}": n for n in range(1, 7)}
+# Kept as raw HTML: their content is not prose
+RAW_TAGS = {"pre", "script", "style", "svg", "table", "textarea"}
+
+# Icons of the technique-meta items, written as :icon-name: in markdown
+ICONS = {
+    "clock": '<svg viewBox="0 0 24 24"><path d="M12 2C6.5 2 2 6.5 2 12s4.5 10 10 10 10-4.5 10-10S17.5 2 '
+             '12 2zm0 18c-4.41 0-8-3.59-8-8s3.59-8 8-8 8 3.59 8 8-3.59 8-8 8zm.5-13H11v6l5.2 3.2.8-1.3'
+             '-4.5-2.7V7z"/></svg>',
+    "calendar": '<svg viewBox="0 0 24 24"><path d="M19 3h-1V1h-2v2H8V1H6v2H5c-1.1 0-2 .9-2 2v14c0 1.1'
+                '.9 2 2 2h14c1.1 0 2-.9 2-2V5c0-1.1-.9-2-2-2zm0 16H5V8h14v11z"/></svg>',
+}
+
+SPEC_TOKEN = re.compile(r'([\w-]+)="([^"]*)"|([@#.]?)([^\s"]+)')
+FENCE_OPEN = re.compile(r"^:::\s+(\S.*)$")
+FENCE_CLOSE = re.compile(r"^:::\s*$")
+ELEMENT = re.compile(r"^::\s+(.*?)\s+::(?:\s+(.*))?$")
+ATTRIBUTE_LINE = re.compile(r"^\{([.#@][^{}]*|[\w-]+=\"[^{}]*)\}$")
+HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+BULLET = re.compile(r"^[-*]\s+(.*)$")
+NUMBERED = re.compile(r"^\d+\.\s+(.*)$")
+QUOTE = re.compile(r"^>\s?(.*)$")
+RULE = re.compile(r"^-{3,}$")
+ICON = re.compile(r":icon-([\w-]+):")
+WHITESPACE = re.compile(r"\s+")
+HTML_WHITESPACE = re.compile(r"[ \t\r\n]+")
+BLOCK_BOUNDARY = re.compile(r"\s*(</?(?:%s)\b[^>]*>)\s*" % "|".join(sorted(BLOCK_TAGS)))
+# Starts of a line the block parser would not read as a paragraph
+BLOCK_START = re.compile(r"^(?:#|[-*]\s|\d+\.\s|>|:|\{|<|---)")
+
+
+# --- HTML tree ---------------------------------------------------------------
+
+class Comment(str):
+    pass
+
+
+class Node:
+    def __init__(self, tag: str, attrs: list, self_closing: bool = False):
+        self.tag = tag
+        self.attrs = attrs
+        self.self_closing = self_closing
+        self.children = []
+
+
+class TreeBuilder(HTMLParser):
+    """Minimal, forgiving DOM: Nodes, text as it appears in the source, and Comments"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.root = Node(None, [])
+        self.stack = [self.root]
+
+    def _append(self, child) -> None:
+        children = self.stack[-1].children
+        if type(child) is str and children and type(children[-1]) is str:
+            children[-1] += child
+        else:
+            children.append(child)
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, attrs)
+        self._append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self._append(Node(tag, attrs, self_closing=tag not in VOID_TAGS))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        self._append(data)
+
+    def handle_entityref(self, name):
+        self._append(f"&{name};")
+
+    def handle_charref(self, name):
+        self._append(f"&#{name};")
+
+    def handle_comment(self, data):
+        self._append(Comment(data))
+
+
+def parse_html(markup: str) -> Node:
+    builder = TreeBuilder()
+    builder.feed(markup)
+    builder.close()
+    return builder.root
+
+
+def render_attributes(attrs: list) -> str:
+    out = []
+    for name, value in attrs:
+        if value is None:
+            out.append(f" {name}")
+        else:
+            out.append(f' {name}="{value.replace("&", "&amp;").replace(chr(34), "&quot;")}"')
+    return "".join(out)
+
+
+def to_html(node) -> str:
+    if isinstance(node, Comment):
+        return f"<!--{node}-->"
+    if isinstance(node, str):
+        return node
+    inner = "".join(to_html(child) for child in node.children)
+    if node.tag is None:
+        return inner
+    attrs = render_attributes(node.attrs)
+    if node.tag in VOID_TAGS:
+        return f"<{node.tag}{attrs}>"
+    if node.self_closing:
+        return f"<{node.tag}{attrs}/>"
+    return f"<{node.tag}{attrs}>{inner}</{node.tag}>"
+
+
+def canonical(node) -> str:
+    if isinstance(node, Comment):
+        return ""
+    if isinstance(node, str):
+        return html.escape(html.unescape(node), quote=False)
+    inner = "".join(canonical(child) for child in node.children)
+    if node.tag is None:
+        return inner
+    attrs = "".join(f" {name}={value!r}" for name, value in sorted(node.attrs))
+    return f"<{node.tag}{attrs}>{inner}</{node.tag}>"
+
+
+def normalize(markup: str) -> str:
+    """Markup reduced to what the browser shows: parsed tags, sorted attributes, collapsed whitespace"""
+    text = HTML_WHITESPACE.sub(" ", canonical(parse_html(markup)))
+    return BLOCK_BOUNDARY.sub(r"\1", text).strip()
+
+
+def equivalent(a: str, b: str) -> bool:
+    return normalize(a) == normalize(b)
+
+
+# --- markdown -> HTML --------------------------------------------------------
+
+def parse_spec(spec: str):
+    """Attribute spec -> (tag or None, [(name, value)]) with all classes in one attribute"""
+    tag, classes, attrs = None, [], []
+    for name, value, sigil, word in SPEC_TOKEN.findall(spec):
+        if name:
+            attrs.append((name, html.unescape(value)))
+        elif sigil == "@":
+            tag = word
+        elif sigil == "#":
+            attrs.append(("id", word))
+        else:
+            classes.append(word)
+    if classes:
+        attrs.insert(0, ("class", " ".join(classes)))
+    return tag, attrs
+
+
+def find_closing(text: str, marker: str, start: int) -> int:
+    """Index of the `marker` closing an emphasis run, skipping escapes and longer runs"""
+    i = start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text.startswith(marker, i):
+            if marker == "*" and text.startswith("**", i):
+                end = find_closing(text, "**", i + 2)
+                if end < 0:
+                    return -1
+                i = end + 2
+                continue
+            return i
+        i += 1
+    return -1
+
+
+def find_bracket(text: str, start: int) -> int:
+    """Index of the ] matching the [ at `start`"""
+    depth, i = 0, start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == "[":
+            depth += 1
+        elif text[i] == "]":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+def render_inline(text: str) -> str:
+    out, i = [], 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\" and i + 1 < len(text) and not text[i + 1].isalnum():
+            out.append(text[i + 1])
+            i += 2
+            continue
+        if text.startswith("**", i):
+            end = find_closing(text, "**", i + 2)
+            if end > i + 2:
+                out.append(f"<strong>{render_inline(text[i + 2:end])}</strong>")
+                i = end + 2
+                continue
+        elif char == "*":
+            end = find_closing(text, "*", i + 1)
+            if end > i + 1:
+                out.append(f"<em>{render_inline(text[i + 1:end])}</em>")
+                i = end + 1
+                continue
+        elif char == "[":
+            end = find_bracket(text, i)
+            if end > 0 and text.startswith("(", end + 1) and ")" in text[end:]:
+                close = text.index(")", end)
+                href = text[end + 2:close]
+                out.append(f'<a{render_attributes([("href", href)])}>{render_inline(text[i + 1:end])}</a>')
+                i = close + 1
+                continue
+            if end > 0 and text.startswith("{", end + 1) and "}" in text[end:]:
+                close = text.index("}", end)
+                _, attrs = parse_spec(text[end + 2:close])
+                out.append(f"<span{render_attributes(attrs)}>{render_inline(text[i + 1:end])}</span>")
+                i = close + 1
+                continue
+        elif char == ":":
+            icon = ICON.match(text, i)
+            if icon and icon.group(1) in ICONS:
+                out.append(ICONS[icon.group(1)])
+                i = icon.end()
+                continue
+        out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def parse_blocks(text: str) -> list:
+    """Markdown -> block tree of dicts with a "kind" and, for containers, "children" """
+    root = {"kind": "container", "children": []}
+    stack = [root]
+    pending = None  # (tag, attrs) from an attribute line
+    lines = text.split("\n")
+    i = 0
+
+    def add(block, default_tag):
+        nonlocal pending
+        tag, attrs = pending or (None, [])
+        pending = None
+        block.setdefault("tag", default_tag)
+        block["tag"] = block.get("spec_tag") or tag or block["tag"]
+        block["attrs"] = attrs + block.get("attrs", [])
+        stack[-1]["children"].append(block)
+        return block
+
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if not line:
+            continue
+        if FENCE_CLOSE.match(line) and len(stack) > 1:
+            stack.pop()
+            continue
+        match = FENCE_OPEN.match(line)
+        if match:
+            tag, attrs = parse_spec(match.group(1))
+            stack.append(add({"kind": "container", "spec_tag": tag, "attrs": attrs, "children": []}, "div"))
+            continue
+        match = ELEMENT.match(line)
+        if match:
+            tag, attrs = parse_spec(match.group(1))
+            add({"kind": "element", "spec_tag": tag, "attrs": attrs, "text": match.group(2) or ""}, "div")
+            continue
+        match = ATTRIBUTE_LINE.match(line)
+        if match:
+            pending = parse_spec(match.group(1))
+            continue
+        match = HEADING.match(line)
+        if match:
+            add({"kind": "element", "text": match.group(2)}, f"h{len(match.group(1))}")
+            continue
+        if RULE.match(line):
+            add({"kind": "void"}, "hr")
+            continue
+        if line.startswith("<"):
+            raw = [lines[i - 1]]
+            while i < len(lines) and lines[i].strip():
+                raw.append(lines[i])
+                i += 1
+            add({"kind": "raw", "lines": raw}, None)
+            continue
+        for pattern, tag in ((BULLET, "ul"), (NUMBERED, "ol")):
+            if pattern.match(line):
+                items = [pattern.match(line).group(1)]
+                while i < len(lines) and pattern.match(lines[i].strip()):
+                    items.append(pattern.match(lines[i].strip()).group(1))
+                    i += 1
+                add({"kind": "list", "items": items}, tag)
+                break
+        else:
+            pattern = QUOTE if QUOTE.match(line) else None
+            paragraph = [QUOTE.match(line).group(1) if pattern else line]
+            while i < len(lines) and lines[i].strip():
+                following = lines[i].strip()
+                if pattern and not QUOTE.match(following):
+                    break
+                if not pattern and (FENCE_OPEN.match(following) or FENCE_CLOSE.match(following)
+                                    or ELEMENT.match(following)):
+                    break
+                paragraph.append(QUOTE.match(following).group(1) if pattern else following)
+                i += 1
+            add({"kind": "element", "text": " ".join(paragraph)}, "blockquote" if pattern else "p")
+    return root["children"]
+
+
+def render_blocks(blocks: list, depth: int) -> list:
+    pad = INDENT * depth
+    lines = []
+    for block in blocks:
+        tag = block["tag"]
+        attrs = render_attributes(block["attrs"])
+        kind = block["kind"]
+        if kind == "container":
+            lines.append(f"{pad}<{tag}{attrs}>")
+            lines.extend(render_blocks(block["children"], depth + 1))
+            lines.append(f"{pad}</{tag}>")
+        elif kind == "element":
+            lines.append(f"{pad}<{tag}{attrs}>{render_inline(block['text'])}</{tag}>")
+        elif kind == "list":
+            lines.append(f"{pad}<{tag}{attrs}>")
+            lines.extend(f"{pad}{INDENT}<li>{render_inline(item)}</li>" for item in block["items"])
+            lines.append(f"{pad}</{tag}>")
+        elif kind == "void":
+            lines.append(f"{pad}<{tag}{attrs}>")
+        else:
+            lines.append(pad + block["lines"][0].strip())
+            lines.extend(block["lines"][1:])
+    return lines
+
+
+def render_markdown(text: str, depth: int = 0) -> str:
+    """HTML for a markdown document, indented to `depth` levels"""
+    return "\n".join(render_blocks(parse_blocks(text), depth))
+
+
+# --- HTML -> markdown --------------------------------------------------------
+
+def attribute_spec(attrs: list, tag: str = None, default_tag: str = "div", bare: bool = False):
+    """Spec text for an element's attributes, or None if the dialect cannot express them"""
+    tokens = []
+    if tag is not None and tag != default_tag:
+        tokens.append(f"@{tag}")
+    for name, value in attrs:
+        if value is None or '"' in value:
+            return None
+        if name == "class":
+            classes = value.split()
+            if not classes or " ".join(classes) != value:
+                return None
+            tokens.extend(classes if bare else (f".{c}" for c in classes))
+        elif name == "id" and value and not WHITESPACE.search(value):
+            tokens.append(f"#{value}")
+        else:
+            tokens.append(f'{name}="{value.replace("&", "&amp;")}"')
+    return " ".join(tokens)
+
+
+def escape_text(text: str) -> str:
+    text = re.sub(r"([\\*\[\]])", r"\\\1", text)
+    text = text.replace("<", "&lt;")
+    return ICON.sub(lambda m: "\\" + m.group(0), text)
+
+
+def icon_name(node: Node):
+    markup = to_html(node)
+    for name, svg in ICONS.items():
+        if equivalent(markup, svg):
+            return name
+    return None
+
+
+def inline_markdown(nodes: list) -> str:
+    parts = []
+    for node in nodes:
+        if isinstance(node, Comment):
+            parts.append(to_html(node))
+        elif isinstance(node, str):
+            parts.append(escape_text(node))
+        elif node.tag in ("strong", "em") and not node.attrs:
+            marker = "**" if node.tag == "strong" else "*"
+            parts.append(f"{marker}{inline_markdown(node.children)}{marker}")
+        elif (node.tag == "a" and [name for name, _ in node.attrs] == ["href"]
+              and not re.search(r"[\s()]", node.attrs[0][1] or " ")):
+            parts.append(f"[{inline_markdown(node.children)}]({node.attrs[0][1]})")
+        elif node.tag == "span" and attribute_spec(node.attrs) is not None:
+            parts.append(f"[{inline_markdown(node.children)}]{{{attribute_spec(node.attrs)}}}")
+        elif node.tag == "svg" and icon_name(node):
+            parts.append(f":icon-{icon_name(node)}:")
+        else:
+            parts.append(to_html(node))
+    return WHITESPACE.sub(" ", "".join(parts))
+
+
+def inline_text(node: Node):
+    """Markdown for an element's inline content if it has only inline children"""
+    for child in node.children:
+        if isinstance(child, Node) and child.tag not in INLINE_TAGS:
+            return None
+    text = inline_markdown(node.children).strip()
+    if not equivalent(render_inline(text), "".join(map(to_html, node.children))):
+        return None
+    return text
+
+
+def block_children(node: Node):
+    """Element and comment children, or None if the element also holds loose text"""
+    children = []
+    for child in node.children:
+        if type(child) is str:
+            if child.strip():
+                return None
+        else:
+            children.append(child)
+    return children
+
+
+def leading_escape(text: str) -> str:
+    """Keep a paragraph from reading as another kind of block"""
+    if NUMBERED.match(text):
+        return re.sub(r"^(\d+)\.", r"\1\\.", text)
+    return "\\" + text if BLOCK_START.match(text) and not text.startswith("\\") else text
+
+
+def try_markdown(node):
+    if isinstance(node, Comment) or node.tag in RAW_TAGS:
+        return None
+    tag = node.tag
+    text = inline_text(node) if tag not in VOID_TAGS else None
+    prefix_spec = attribute_spec(node.attrs)
+    attribute_line = f"{{{prefix_spec}}}\n" if node.attrs and prefix_spec else ""
+
+    if tag in HEADINGS and text and (prefix_spec is not None):
+        return f"{attribute_line}{'#' * HEADINGS[tag]} {text}"
+    if tag == "p" and text and prefix_spec is not None:
+        return attribute_line + leading_escape(text)
+    if tag == "blockquote" and text and prefix_spec is not None:
+        return f"{attribute_line}> {text}"
+    if tag == "hr" and not node.attrs:
+        return "---"
+    if tag in ("ul", "ol") and prefix_spec is not None:
+        items = block_children(node)
+        if items and all(isinstance(i, Node) and i.tag == "li" and not i.attrs for i in items):
+            texts = [inline_text(item) for item in items]
+            if all(t is not None for t in texts):
+                marks = ["-"] * len(texts) if tag == "ul" else [f"{n}." for n in range(1, len(texts) + 1)]
+                return attribute_line + "\n".join(f"{m} {t}" for m, t in zip(marks, texts))
+    if tag in VOID_TAGS:
+        return None
+
+    spec = attribute_spec(node.attrs, tag, bare=True)
+    if spec is None:
+        return None
+    if text is not None:
+        return f":: {spec or '@div'} :: {text}".rstrip()
+    children = block_children(node)
+    if children:
+        body = "\n\n".join(block_markdown(child) for child in children)
+        return f"::: {spec or '@div'}\n\n{body}\n\n:::"
+    return None
+
+
+def raw_markdown(node) -> str:
+    return "\n".join(line for line in to_html(node).split("\n") if line.strip())
+
+
+def block_markdown(node) -> str:
+    """Markdown for one block; whatever would not render back identically stays raw HTML"""
+    markdown = try_markdown(node)
+    if markdown is not None and equivalent(render_markdown(markdown), to_html(node)):
+        return markdown
+    return raw_markdown(node)
+
+
+def html_to_markdown(markup: str):
+    """Markdown for a fragment of page HTML, or None if it has loose top-level text"""
+    children = block_children(parse_html(markup))
+    if children is None:
+        return None
+    return "\n\n".join(block_markdown(child) for child in children) + "\n"
@@ -0,0 +1,106 @@
+// Service worker of Focal Psychology, written to sw.js by build_assets.py.
+// The site shell is cached on install; every other file of precache.json is
+// cached the first time it is used. Cache keys carry the file's content hash,
+// so a file is fetched again exactly when its content changed.
+const BUILD = '${build}';
+const CACHE = 'focal-psychology';
+const MANIFEST_URL = 'precache.json?v=' + BUILD;
+
+let manifestPromise = null;
+
+function cacheKey(path, hash) {
+    return new URL(path + '?rev=' + hash, self.registration.scope).href;
+}
+
+function manifest() {
+    if (!manifestPromise) {
+        manifestPromise = caches.open(CACHE)
+            .then(cache => cache.match(MANIFEST_URL))
+            .then(response => response ? response.json() : (manifestPromise = null));
+    }
+    return manifestPromise;
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        const response = await fetch(MANIFEST_URL, { cache: 'no-cache' });
+        if (!response.ok) {
+            throw new Error('precache.json: HTTP ' + response.status);
+        }
+        await cache.put(MANIFEST_URL, response.clone());
+        const data = await response.json();
+        await Promise.all(data.precache.map(async path => {
+            const key = cacheKey(path, data.files[path]);
+            if (await cache.match(key)) {
+                return;
+            }
+            const file = await fetch(new URL(path, self.registration.scope), { cache: 'no-cache' });
+            if (file.ok) {
+                await cache.put(key, file);
+            }
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        // Drop every file whose hash is not in this build's manifest
+        const data = await manifest();
+        const cache = await caches.open(CACHE);
+        const current = new Set(Object.keys(data.files).map(path => cacheKey(path, data.files[path])));
+        current.add(new URL(MANIFEST_URL, self.location).href);
+        const keys = await cache.keys();
+        await Promise.all(keys.filter(request => !current.has(request.url))
+            .map(request => cache.delete(request)));
+        await self.clients.claim();
+    })());
+});
+
+async function respond(event, path) {
+    const data = await manifest();
+    const hash = data && data.files[path];
+    if (!hash) {
+        return fetch(event.request);
+    }
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(cacheKey(path, hash));
+    if (cached) {
+        return cached;
+    }
+    try {
+        // Past the HTTP cache: a copy cached before the deploy would be stored under the new hash.
+        // Navigation requests cannot take options, so those are fetched by URL
+        const response = await (event.request.mode === 'navigate'
+            ? fetch(event.request.url, { cache: 'no-cache' })
+            : fetch(event.request, { cache: 'no-cache' }));
+        if (response.ok && response.type === 'basic') {
+            event.waitUntil(cache.put(cacheKey(path, hash), response.clone()));
+        }
+        return response;
+    } catch (error) {
+        // Offline and never opened: the start page is always cached
+        const start = event.request.mode === 'navigate' && data.files['index.html']
+            && await cache.match(cacheKey('index.html', data.files['index.html']));
+        if (start) {
+            return start;
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const scope = new URL(self.registration.scope);
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || request.headers.has('range') || url.origin !== scope.origin
+        || !url.pathname.startsWith(scope.pathname)) {
+        return;
+    }
+    let path = decodeURIComponent(url.pathname.slice(scope.pathname.length));
+    if (path === '' || path.endsWith('/')) {
+        path += 'index.html';
+    }
+    event.respondWith(respond(event, path));
+});
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Versioned ComfyUI workflow templates for Focal Psychology images
+Each graph in workflows/ is parsed and validated once; a job only fills in
+its parameters (prompt, seed, batch size, resolution)
+"""
+
+import json
+from functools import lru_cache
+from pathlib import Path
+
+WORKFLOWS_DIR = Path(__file__).parent / "workflows"
+# Every template must bind these; the rest need a default
+REQUIRED_PARAMETERS = ('prompt', 'seed', 'batch_size')
+# Inputs that name the weights a graph loads; different values mean a model swap
+MODEL_INPUTS = ('ckpt_name', 'unet_name', 'clip_name', 'vae_name', 'lora_name')
+
+
+def is_link(value) -> bool:
+    """A node input wired to another node's output: [node_id, output_index]"""
+    return (isinstance(value, list) and len(value) == 2
+            and isinstance(value[0], str) and isinstance(value[1], int))
+
+
+class WorkflowTemplate:
+    """
+    A ComfyUI API graph with named parameters bound to node inputs.
+
+    `parameters` maps a name to the [node_id, input] pairs it fills and an
+    optional default. render() copies only the nodes a parameter touches;
+    the other nodes are shared by every rendered workflow, so treat rendered
+    workflows as read-only.
+    """
+
+    def __init__(self, name: str, version: int, graph: dict, parameters: dict):
+        self.name = name
+        self.version = version
+        self.graph = graph
+        self.parameters = parameters
+        self._bound_nodes = {node_id for spec in parameters.values() for node_id, _ in spec['targets']}
+
+    @classmethod
+    def load(cls, path: Path) -> "WorkflowTemplate":
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        template = cls(data.get('name'), data.get('version'), data.get('graph'), data.get('parameters'))
+        template.validate(path.name)
+        return template
+
+    def validate(self, source: str) -> None:
+        """Raise ValueError naming `source` if the template cannot render a runnable graph"""
+        def fail(message):
+            raise ValueError(f"{source}: {message}")
+
+        if not isinstance(self.name, str) or not isinstance(self.version, int):
+            fail("needs a string name and an integer version")
+        if not isinstance(self.graph, dict) or not self.graph:
+            fail("graph is empty")
+        for node_id, node in self.graph.items():
+            if (not isinstance(node, dict) or not isinstance(node.get('class_type'), str)
+                    or not isinstance(node.get('inputs'), dict)):
+                fail(f"node {node_id} needs a class_type and inputs")
+            for input_name, value in node['inputs'].items():
+                if is_link(value) and value[0] not in self.graph:
+                    fail(f"node {node_id} input {input_name} links to missing node {value[0]}")
+        if sum(1 for node in self.graph.values() if node['class_type'] == 'SaveImage') != 1:
+            fail("needs exactly one SaveImage node")
+
+        if not isinstance(self.parameters, dict):
+            fail("parameters missing")
+        for name in REQUIRED_PARAMETERS:
+            if name not in self.parameters:
+                fail(f"parameter {name} is not bound")
+        for name, spec in self.parameters.items():
+            if not spec.get('targets'):
+                fail(f"parameter {name} has no targets")
+            if name not in REQUIRED_PARAMETERS and 'default' not in spec:
+                fail(f"optional parameter {name} needs a default")
+            for node_id, input_name in spec['targets']:
+                if input_name not in self.graph.get(node_id, {}).get('inputs', {}):
+                    fail(f"parameter {name} targets missing input {node_id}.{input_name}")
+
+    def render(self, **values) -> dict:
+        """The graph for one job; unknown or missing required parameters raise ValueError"""
+        unknown = set(values) - set(self.parameters)
+        if unknown:
+            raise ValueError(f"{self.name}: unknown parameters {', '.join(sorted(unknown))}")
+        workflow = {node_id: node if node_id not in self._bound_nodes
+                    else {**node, 'inputs': dict(node['inputs'])}
+                    for node_id, node in self.graph.items()}
+        for name, spec in self.parameters.items():
+            if name in values:
+                value = values[name]
+            elif 'default' in spec:
+                value = spec['default']
+            else:
+                raise ValueError(f"{self.name}: parameter {name} is required")
+            for node_id, input_name in spec['targets']:
+                workflow[node_id]['inputs'][input_name] = value
+        return workflow
+
+
+@lru_cache(maxsize=None)
+def load_template(name: str) -> WorkflowTemplate:
+    """workflows/<name>.json, e.g. load_template("qwen-image.v1"); loaded once per process"""
+    return WorkflowTemplate.load(WORKFLOWS_DIR / f"{name}.json")
+
+
+def residency_key(workflow: dict) -> tuple:
+    """
+    What ComfyUI keeps loaded between prompts: the model files and the
+    latent resolution. Jobs with equal keys run back to back without a swap.
+    """
+    models, size = set(), None
+    for node in workflow.values():
+        inputs = node.get('inputs', {})
+        models.update((name, inputs[name]) for name in MODEL_INPUTS if isinstance(inputs.get(name), str))
+        if isinstance(inputs.get('width'), int) and isinstance(inputs.get('height'), int):
+            size = (inputs['width'], inputs['height'])
+    return tuple(sorted(models)), size